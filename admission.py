@@ -0,0 +1,161 @@
+# admission.py
+
+import math
+import time
+import heapq
+import asyncio
+import itertools
+import contextvars
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+from llm_wrapper import MAX_IN_FLIGHT, MAX_WAITING
+from metrics import metrics
+
+FAST_LANE_WORKERS = 4            # thread riservati ai comandi (timer, calendario, task)
+CLASSIFY_WORKERS  = 2            # thread per l'embedding dei messaggi senza parole chiave di comando
+CLASSIFY_QUEUE    = 16           # embedding in attesa oltre i quali si risponde subito 429
+LLM_CONCURRENCY   = MAX_IN_FLIGHT  # unico limite alle generazioni: il client Ollama dell'API non ne ha un altro
+LLM_QUEUE_SIZE    = MAX_WAITING  # richieste LLM in attesa oltre le quali si risponde 429
+LLM_QUEUE_DEADLINE = 10.0        # secondi massimi in coda prima di rinunciare con 503
+
+# Priorità (più basso = prima)
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH       = 10
+
+class AdmissionError(RuntimeError):
+    """Richiesta LLM rifiutata per sovraccarico; retry_after in secondi"""
+    status_code = 503
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class QueueFullError(AdmissionError):
+    """Coda LLM piena: rifiuto immediato"""
+    status_code = 429
+
+class QueueTimeoutError(AdmissionError):
+    """Rimasta in coda oltre la scadenza"""
+    status_code = 503
+
+class FastLane:
+    """
+    Pool di thread dedicato ai comandi: non si mette in fila dietro al lavoro per l'LLM.
+    Con max_queue, oltre `workers + max_queue` chiamate in corso si rifiuta con QueueFullError.
+    Va usato da un solo event loop.
+    """
+
+    def __init__(self, workers: int = FAST_LANE_WORKERS, name: str = "fast-lane", max_queue: int = None):
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix=name)
+        self.name      = name
+        self.limit     = None if max_queue is None else workers + max_queue
+        self._pending  = 0
+
+    async def run(self, fn, *args):
+        """Esegue fn(*args) nel pool, mantenendo il contesto (es. i tempi della richiesta)"""
+        if self.limit is not None and self._pending >= self.limit:
+            metrics.inc("admission", result=f"rejected_{self.name}")
+            raise QueueFullError(f"Coda {self.name} piena", 1)
+        context = contextvars.copy_context()
+        self._pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, context.run, fn, *args)
+        finally:
+            self._pending -= 1
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+class LLMAdmission:
+    """
+    Ammissione al lavoro LLM: al massimo `concurrency` richieste attive, le altre in una coda
+    a priorità limitata (a parità di priorità, in ordine di arrivo). Coda piena -> QueueFullError,
+    attesa oltre `deadline` -> QueueTimeoutError; entrambe portano un Retry-After stimato.
+    Va usata da un solo event loop.
+    """
+
+    def __init__(self, concurrency: int = LLM_CONCURRENCY, max_queue: int = LLM_QUEUE_SIZE,
+                 deadline: float = LLM_QUEUE_DEADLINE):
+        self.concurrency = concurrency
+        self.max_queue   = max_queue
+        self.deadline    = deadline
+        self._active     = 0
+        self._queue      = []   # heap di (priorità, ordine di arrivo, future)
+        self._order      = itertools.count()
+        self._hold       = None # media mobile della durata di uno slot (secondi)
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @property
+    def waiting(self) -> int:
+        return len(self._queue)
+
+    def retry_after(self) -> int:
+        """Secondi stimati prima che si liberi posto per una nuova richiesta"""
+        hold = self._hold or 1.0
+        return max(1, math.ceil(hold * (len(self._queue) + 1) / self.concurrency))
+
+    def check(self):
+        """Solleva QueueFullError se una nuova richiesta verrebbe rifiutata (per rispondere prima dello streaming)"""
+        if self._active >= self.concurrency and len(self._queue) >= self.max_queue:
+            metrics.inc("admission", result="rejected_full")
+            raise QueueFullError("Coda LLM piena", self.retry_after())
+
+    @asynccontextmanager
+    async def slot(self, priority: int = PRIORITY_INTERACTIVE):
+        """Occupa uno slot LLM per la durata del blocco"""
+        await self._acquire(priority)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - start
+            self._hold = elapsed if self._hold is None else 0.8 * self._hold + 0.2 * elapsed
+            self._release()
+
+    async def _acquire(self, priority: int):
+        if self._active < self.concurrency and not self._queue:
+            self._active += 1
+            metrics.inc("admission", result="admitted")
+            return
+        self.check()
+
+        entry = (priority, next(self._order), asyncio.get_running_loop().create_future())
+        heapq.heappush(self._queue, entry)
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(entry[2], self.deadline)
+        except asyncio.TimeoutError:
+            self._abandon(entry)
+            metrics.inc("admission", result="rejected_deadline")
+            raise QueueTimeoutError(f"Oltre {self.deadline:.0f}s in coda per l'LLM", self.retry_after())
+        except asyncio.CancelledError:
+            self._abandon(entry)
+            raise
+        metrics.inc("admission", result="queued")
+        metrics.record("llm_queue_wait", time.perf_counter() - start)
+
+    def _abandon(self, entry):
+        """Toglie dalla coda chi rinuncia; se nel frattempo aveva ricevuto lo slot, lo passa al successivo"""
+        if entry in self._queue:
+            self._queue.remove(entry)
+            heapq.heapify(self._queue)
+        future = entry[2]
+        if future.done() and not future.cancelled():
+            self._release()
+
+    def _release(self):
+        """Passa lo slot al primo in coda ancora in attesa, altrimenti lo libera"""
+        while self._queue:
+            _, _, future = heapq.heappop(self._queue)
+            if not future.done():
+                future.set_result(None)
+                return
+        self._active -= 1
+
+    def status(self) -> dict:
+        return {"active": self._active, "waiting": len(self._queue), "concurrency": self.concurrency,
+                "max_queue": self.max_queue, "retry_after": self.retry_after()}
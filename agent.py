@@ -1,6 +1,8 @@
 import importlib
 import logging
 
+from commands.matcher import KeywordMatcher
+
 # Configurazione logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -10,38 +12,48 @@ TASKS = {
     "meteo": "weather_fake",
 }
 
+# Matcher compilato una volta sola: parole intere, una passata sull'input
+_task_matcher = KeywordMatcher({keyword: keyword for keyword in TASKS})
+
 # Cache per evitare di reimportare moduli
 _module_cache = {}
 
+def match_task(command: str):
+    """Parola chiave di TASKS presente nel comando (a parità, vale l'ordine di TASKS)"""
+    found = _task_matcher.intents(command)
+    for keyword in TASKS:
+        if keyword in found:
+            return keyword
+    return None
+
 def dispatch(command: str) -> str:
     """
     Dispatcher migliorato con cache dei moduli e logging
     """
-    command_lower = command.lower()
-    
-    for keyword, module_name in TASKS.items():
-        if keyword in command_lower:
-            try:
-                # Usa cache se disponibile
-                if module_name not in _module_cache:
-                    mod = importlib.import_module(f"tasks.{module_name}")
-                    _module_cache[module_name] = mod
-                    logger.info(f"Modulo {module_name} caricato e messo in cache")
-                else:
-                    mod = _module_cache[module_name]
-                
-                result = mod.run(command)
-                logger.info(f"Comando '{keyword}' eseguito con successo")
-                return result
-                
-            except ImportError as e:
-                logger.error(f"Errore nell'importazione del modulo {module_name}: {e}")
-                return f"❌ Errore: modulo '{module_name}' non trovato"
-            except Exception as e:
-                logger.error(f"Errore nell'esecuzione del comando '{keyword}': {e}")
-                return f"❌ Errore nell'esecuzione del comando: {e}"
+    keyword = match_task(command)
+    if keyword is None:
+        return None
     
-    return None
+    module_name = TASKS[keyword]
+    try:
+        # Usa cache se disponibile
+        if module_name not in _module_cache:
+            mod = importlib.import_module(f"tasks.{module_name}")
+            _module_cache[module_name] = mod
+            logger.info(f"Modulo {module_name} caricato e messo in cache")
+        else:
+            mod = _module_cache[module_name]
+        
+        result = mod.run(command)
+        logger.info(f"Comando '{keyword}' eseguito con successo")
+        return result
+        
+    except ImportError as e:
+        logger.error(f"Errore nell'importazione del modulo {module_name}: {e}")
+        return f"❌ Errore: modulo '{module_name}' non trovato"
+    except Exception as e:
+        logger.error(f"Errore nell'esecuzione del comando '{keyword}': {e}")
+        return f"❌ Errore nell'esecuzione del comando: {e}"
 
 def get_available_commands():
     """Restituisce la lista dei comandi disponibili"""
@@ -1,89 +1,127 @@
 # api_server.py
 
-import subprocess
-import requests
+import asyncio
+import json
+import os
 import time
-import sys
 import atexit
 import logging
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel, Field
 from typing import Optional, List
 
-from llm_wrapper import LocalLLM
-from memory.memory import load_memory, save_memory
+import embeddings
+from admission import FastLane, LLMAdmission, AdmissionError, CLASSIFY_WORKERS, CLASSIFY_QUEUE, PRIORITY_BATCH
+from metrics import metrics, start_request, end_request, server_timing
+from llm_wrapper import LocalLLM, OllamaClient, OllamaBusyError
+from ollama_supervisor import supervisor, OllamaUnavailableError
+from response_cache import ResponseCache
+from single_flight import SingleFlight
+from memory.namespaces import NamespaceManager, DEFAULT_NAMESPACE, SESSION_ID_PATTERN
+from memory.writer import MemoryWriter
+from memory.workers import (acquire_writer_lock, WriterIntake, ForwardingWriter, RemoteTimers, TimerRelay,
+                            WriterUnavailableError)
 from agent import dispatch, get_available_commands
-from memory.semantic_memory import SemanticMemory
-from commands.registry import dispatch_semantic_hybrid
+from commands.registry import dispatch_keywords, dispatch_embedding, dispatch_semantic_hybrid_batch
+from commands.scheduler import scheduler
 from fastapi import WebSocket, WebSocketDisconnect
-from webSocket import WebSocketServerSingleton
+from webSocket import WebSocketServerSingleton, send_ws_message
 
 # Configurazione logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # === Variabili globali ===
-sem_mem = None
+namespaces = None
 llm = None
-memory = None
-ollama_process = None
+memory_writer = None
+writer_lock = None     # tenuto dal worker che scrive la memoria (None negli altri)
+
+# Generazioni LLM contemporanee per una richiesta batch
+BATCH_LLM_CONCURRENCY = 4
+
+# I comandi girano su thread propri; il lavoro per l'LLM passa da una coda a priorità limitata.
+# L'embedding serve solo ai messaggi senza parole chiave di comando e ha un suo pool con coda
+# limitata: i messaggi diretti all'LLM non occupano la corsia dei comandi
+fast_lane = FastLane()
+classifier = FastLane(CLASSIFY_WORKERS, "classify", max_queue=CLASSIFY_QUEUE)
+llm_admission = LLMAdmission()
+
+# Domande identiche in corso (stesso testo normalizzato, modello e sessione) calcolate una volta sola
+chat_flights = SingleFlight("chat")
+
+# Header Server-Timing con i tempi per fase: sempre, oppure solo se il client invia "X-Timing: 1"
+TIMING_HEADER = False
 
 # === Modelli per l'API ===
+SessionId = Field(DEFAULT_NAMESPACE, pattern=SESSION_ID_PATTERN,
+                  description="Sessione/utente: ognuna ha memoria e cronologia separate")
+
+ModelName = Field(None, description="Modello Ollama tra quelli precaricati (default: quello principale)")
+
 class ChatRequest(BaseModel):
     message: str = Field(..., min_length=1, description="Messaggio da inviare all'assistente")
+    session_id: str = SessionId
+    model: Optional[str] = ModelName
 
 class ChatResponse(BaseModel):
     response: str
     command_type: Optional[str] = None  # Tipo di comando eseguito
     
+class BatchChatRequest(BaseModel):
+    messages: List[str] = Field(..., min_length=1, description="Messaggi da elaborare in blocco")
+    save: bool = Field(False, description="Salva le interazioni in memoria (di default no, per i replay)")
+    run_commands: bool = Field(False, description="Esegue anche i comandi con effetti, come i timer "
+                                                  "(di default sono solo riconosciuti, per i replay)")
+    session_id: str = SessionId
+    model: Optional[str] = ModelName
+
+class BatchChatResponse(BaseModel):
+    results: List[ChatResponse]
+
 class StatusResponse(BaseModel):
     status: str
     ollama_running: bool
     available_commands: List[str]
+    models: List[str] = []
+    ollama: Optional[dict] = None   # stato in cache del supervisore
+    admission: Optional[dict] = None  # slot LLM occupati e richieste in coda
+    worker: Optional[dict] = None     # processo che ha risposto e suo ruolo sulla memoria
 
 class CorrectionRequest(BaseModel):
     old_phrase: str = Field(..., min_length=1)
     new_phrase: str = Field(..., min_length=1)
+    session_id: str = SessionId
 
 # === Funzioni di utilità ===
 def is_ollama_running() -> bool:
-    """Verifica se Ollama è in esecuzione"""
-    try:
-        res = requests.get("http://localhost:11434", timeout=5)
-        return res.status_code == 200
-    except Exception as e:
-        logger.warning(f"Ollama non raggiungibile: {e}")
-        return False
+    """Ultimo stato noto di Ollama (in cache, nessuna richiesta di rete)"""
+    return supervisor.ready
 
-def start_ollama():
-    """Avvia Ollama in background"""
-    global ollama_process
+def check_model(model: Optional[str]) -> str:
+    """Modello richiesto, o HTTP 400 se non è tra quelli configurati"""
     try:
-        logger.info("⚙️ Avvio Ollama in background...")
-        ollama_process = subprocess.Popen(
-            ["ollama", "serve"], 
-            stdout=subprocess.DEVNULL, 
-            stderr=subprocess.DEVNULL
-        )
-        time.sleep(3)  # Tempo di inizializzazione aumentato
-        return True
-    except Exception as e:
-        logger.error(f"Errore nell'avvio di Ollama: {e}")
-        return False
+        return llm.resolve_model(model)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def retry_after(e: Exception) -> int:
+    """Secondi da suggerire al client dopo un rifiuto per sovraccarico"""
+    return e.retry_after if isinstance(e, AdmissionError) else llm_admission.retry_after()
+
+def overloaded(e: Exception) -> HTTPException:
+    """429 (coda piena) o 503 (attesa scaduta, Ollama saturo) con Retry-After"""
+    status_code = e.status_code if isinstance(e, AdmissionError) else 503
+    return HTTPException(status_code=status_code, detail="Assistente occupato, riprova tra poco",
+                         headers={"Retry-After": str(retry_after(e))})
 
 def cleanup():
     """Pulizia risorse all'uscita"""
-    global ollama_process
-    if ollama_process:
-        logger.info("🧹 Chiusura Ollama...")
-        ollama_process.terminate()
-        try:
-            ollama_process.wait(timeout=5)
-        except subprocess.TimeoutExpired:
-            ollama_process.kill()
-        logger.info("✅ Ollama terminato")
+    supervisor.stop()
 
 # Registra la funzione di cleanup
 atexit.register(cleanup)
@@ -92,37 +130,70 @@ atexit.register(cleanup)
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
-    global sem_mem, llm, memory
+    global namespaces, llm, memory_writer, writer_lock
     
     logger.info("🚀 Avvio dell'assistente virtuale...")
     
-    # Inizializza componenti
-    sem_mem = SemanticMemory()
-    llm = LocalLLM()
-    memory = load_memory()
+    # Il modello di embeddings si carica in parallelo all'avvio di Ollama
+    embeddings.warm_up_in_background()
     
-    # Verifica e avvia Ollama
-    if not is_ollama_running():
-        if start_ollama():
-            # Attendi che Ollama sia pronto
-            for attempt in range(15):  # Aumentato da 10 a 15
-                if is_ollama_running():
-                    logger.info("✅ Ollama avviato con successo")
-                    break
-                time.sleep(1)
-                logger.info(f"⏳ Tentativo {attempt + 1}/15 - Attendo Ollama...")
-            else:
-                logger.error("❌ Ollama non si è avviato entro il timeout")
-                raise RuntimeError("Impossibile avviare Ollama")
-        else:
-            raise RuntimeError("Errore nell'avvio di Ollama")
+    # Con più worker (uvicorn --workers N) uno solo scrive la memoria e gestisce Ollama;
+    # gli altri leggono la memoria in memory map e gli inoltrano le scritture
+    writer_lock = acquire_writer_lock()
+    leader = writer_lock is not None
+    
+    # Ollama si avvia e viene sorvegliato in background: l'API accetta subito le richieste
+    supervisor.start(asyncio.get_running_loop(), spawn=leader)
+    
+    # Inizializza componenti
+    # Le generazioni le limita solo llm_admission (con priorità e scadenza), non anche il client
+    llm = LocalLLM(cache=ResponseCache(), client=OllamaClient(max_in_flight=None))
+    intake = timer_relay = None
+    if leader:
+        # I timer girano sull'event loop del server, insieme ai WebSocket (in un solo worker)
+        scheduler.start(asyncio.get_running_loop())
+        memory_writer = MemoryWriter(resolve=lambda session_id: namespaces.get(session_id))
+        memory_writer.start()
+        # Un namespace scaricato si chiude solo dopo che lo scrittore ha salvato le sue interazioni
+        namespaces = NamespaceManager(on_evict=lambda ns: memory_writer.submit_close(ns, namespaces.finish_close))
+        # Un altro worker si collega appena avviato: da lì i turni di una sessione possono finire
+        # su processi diversi, e il contesto di Ollama di questo worker non li conterrebbe tutti
+        intake = WriterIntake(namespaces, memory_writer, scheduler, on_connect=llm.contexts.disable)
+        await intake.start()
     else:
-        logger.info("✅ Ollama è già attivo")
+        memory_writer = ForwardingWriter()
+        memory_writer.start()
+        namespaces = NamespaceManager(read_only=True)
+        llm.contexts.disable()
+        # Timer gestiti dallo scrittore; quelli che suonano si notificano ai client di questo worker
+        scheduler.use_remote(RemoteTimers())
+        timer_relay = TimerRelay(lambda timer: send_ws_message(timer["message"]))
+        timer_relay.start()
+        logger.info(f"📖 Worker {os.getpid()}: memoria in sola lettura, scritture inoltrate")
+    await run_in_threadpool(namespaces.get, DEFAULT_NAMESPACE)
+    
+    # Precarica i modelli appena Ollama è pronto e li tiene in memoria (una volta per tutti i worker)
+    keep_warm_task = asyncio.create_task(llm.keep_warm(wait_ready=supervisor.wait_ready)) if leader else None
     
     yield
     
     # Shutdown
+    if keep_warm_task is not None:
+        keep_warm_task.cancel()
+    scheduler.stop()
+    await llm.aclose()
+    if intake is not None:
+        await intake.close()
+    if timer_relay is not None:
+        await timer_relay.close()
+    await memory_writer.close()
+    namespaces.close_all()
+    fast_lane.shutdown()
+    classifier.shutdown()
     cleanup()
+    if writer_lock is not None:
+        writer_lock.close()
+        writer_lock = None
 
 # === Creazione app FastAPI ===
 app = FastAPI(
@@ -141,92 +212,394 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def record_timings(request: Request, call_next):
+    """Latenza per endpoint e, su richiesta, header Server-Timing con i tempi per fase"""
+    token = start_request()
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        timings = end_request(token)
+    elapsed = time.perf_counter() - start
+
+    route = request.scope.get("route")
+    metrics.observe("http_request_seconds", elapsed, method=request.method,
+                    path=getattr(route, "path", "other"), status=response.status_code)
+    if TIMING_HEADER or request.headers.get("x-timing") == "1":
+        response.headers["Server-Timing"] = server_timing(timings, elapsed)
+    return response
+
 # === Endpoints ===
 @app.get("/health", response_model=StatusResponse)
 def get_status():
-    """Ottieni lo stato dell'assistente"""
+    """Ottieni lo stato dell'assistente (dalla cache del supervisore, senza attese)"""
     return StatusResponse(
         status="active",
         ollama_running=is_ollama_running(),
-        available_commands=get_available_commands()
+        available_commands=get_available_commands(),
+        models=list(llm.models),
+        ollama=supervisor.status(),
+        admission=llm_admission.status(),
+        worker={"pid": os.getpid(), "memory": "writer" if writer_lock is not None else "reader"}
     )
 
+@app.get("/metrics")
+def get_metrics():
+    """Metriche nel formato di Prometheus (latenze per fase e per tipo di comando, contatori)"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/health/live")
+def liveness():
+    """Liveness: il processo risponde (non dipende da Ollama)"""
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+def readiness():
+    """Readiness: Ollama è pronto a generare; 503 durante l'avvio o se non disponibile"""
+    status = {"ready": supervisor.ready, "embeddings_loaded": embeddings.is_loaded(), "ollama": supervisor.status()}
+    return JSONResponse(status, status_code=200 if supervisor.ready else 503)
+
 @app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket):
+async def websocket_endpoint(websocket: WebSocket,
+                             session_id: str = Query(DEFAULT_NAMESPACE, pattern=SESSION_ID_PATTERN),
+                             model: Optional[str] = None):
+    try:
+        model = llm.resolve_model(model)
+    except ValueError:
+        await websocket.close(code=1008)
+        return
     ws_manager = WebSocketServerSingleton()
     await ws_manager.connect(websocket)
     try:
         while True:
             data = await websocket.receive_text()
             logger.info(f"📩 Messaggio ricevuto: {data}")
-            await ws_manager.broadcast(f"Echo: {data}")
+            command = data.strip()
+            if not command:
+                continue
+
+            # I token vengono inviati solo a chi ha fatto la domanda, tramite la sua coda
+            start = time.perf_counter()
+            chunks = []
+            command_type = "llm"   # i comandi producono sempre un frammento, l'LLM anche nessuno
+            try:
+                async for command_type, chunk in stream_chat(command, session_id, model):
+                    chunks.append(chunk)
+                    await ws_manager.send(websocket, {"type": "token", "token": chunk})
+            except (AdmissionError, OllamaBusyError) as e:
+                logger.warning(f"LLM saturo: {e}")
+                metrics.inc("dispatch", path="busy")
+                await ws_manager.send(websocket, {"type": "error", "detail": "Assistente occupato, riprova tra poco",
+                                                  "retry_after": retry_after(e)})
+                continue
+            except OllamaUnavailableError as e:
+                logger.warning(f"LLM non disponibile: {e}")
+                metrics.inc("dispatch", path="unavailable")
+                await ws_manager.send(websocket, {"type": "error", "detail": "Assistente in avvio, riprova tra poco"})
+                continue
+
+            response = "".join(chunks)
+            await ws_manager.send(websocket, {"type": "end", "response": response, "command_type": command_type})
+            save_interaction(command, response, session_id)
+            record_chat("/ws", command_type, start)
     except WebSocketDisconnect:
-        ws_manager.disconnect(websocket)
         logger.info("🔌 Connessione WebSocket chiusa")
+    finally:
+        ws_manager.disconnect(websocket)
+
+
+def resolve_command(command: str):
+    """Dispatcher che non calcolano embeddings (parole chiave, task): (risposta, tipo) o (None, None)"""
+    with metrics.timer("dispatch_keywords"):
+        response = dispatch_keywords(command)
+    if response:
+        return response, "semantic"
+
+    with metrics.timer("dispatch_traditional"):
+        response = dispatch(command)
+    if response:
+        return response, "traditional"
+
+    return None, None
+
+def resolve_semantic(command: str):
+    """Matching dei comandi tramite embedding: (risposta, "semantic") o (None, None)"""
+    emb = embeddings.embed(command)
+    with metrics.timer("dispatch_semantic"):
+        response = dispatch_embedding(command, input_emb=emb)
+    return (response, "semantic") if response else (None, None)
 
+async def resolve(command: str):
+    """
+    Comando o LLM? Prima i dispatcher senza embeddings sulla corsia veloce; solo se non trovano
+    nulla, l'embedding sul pool di classificazione. Con la coda LLM piena il messaggio si rifiuta
+    prima di calcolarlo (AdmissionError), come quando è piena la coda di classificazione.
+    """
+    resolved = await fast_lane.run(resolve_command, command)
+    if resolved[0] is not None:
+        return resolved
+    llm_admission.check()
+    return await classifier.run(resolve_semantic, command)
+
+def build_prompt(command: str, session_id: str = DEFAULT_NAMESPACE):
+    """
+    Costruisce il prompt per l'LLM con il contesto della memoria semantica della sessione.
+    Restituisce (prompt, contesto, embedding della domanda) per la cache delle risposte.
+    """
+    emb = embeddings.embed(command)
+    with metrics.timer("retrieval"):
+        context = namespaces.get(session_id).sem_mem.context(command, emb=emb)
+    return format_prompt(command, context), context, emb
+
+def conversation(session_id: str):
+    """
+    Conversazione di cui l'LLM riusa il contesto tra un turno e l'altro: solo per sessioni esplicite,
+    il namespace di default è condiviso da client diversi.
+    """
+    return None if session_id == DEFAULT_NAMESPACE else session_id
+
+def format_prompt(command: str, context: str) -> str:
+    """Prompt per l'LLM con l'eventuale contesto recuperato"""
+    return (f"Contesto precedente:\n{context}\nDomanda: {command}" if context and context != command else command)
+
+async def stream_chat(command: str, session_id: str = DEFAULT_NAMESPACE, model: str = None, resolved: tuple = None):
+    """
+    Genera coppie (tipo comando, frammento): un solo frammento per i comandi, token per l'LLM.
+    `resolved` è l'esito di resolve_command se già calcolato dal chiamante.
+    """
+    response, command_type = resolved or await resolve(command)
+    if response is not None:
+        yield command_type, response
+        return
+
+    await supervisor.require_ready()
+    key = (embeddings.normalize(command), model, session_id)
+    async for token in chat_flights.stream(key, lambda: stream_answer(command, session_id, model)):
+        yield "llm", token
+
+def answer(command: str, session_id: str, model: str):
+    """Fallback sull'LLM: contesto dalla memoria della sessione e risposta completa"""
+    async def generate():
+        # Lo slot copre anche il recupero del contesto: chi viene rifiutato non costa embedding né ricerca
+        async with llm_admission.slot():
+            prompt, context, emb = await run_in_threadpool(build_prompt, command, session_id)
+            return await llm.arespond(prompt, embedding=emb, context=context, model=model,
+                                      session=conversation(session_id))
+
+    # I comandi non passano di qui: le loro azioni (es. i timer) non vanno mai unite
+    return chat_flights.do((embeddings.normalize(command), model, session_id), generate)
+
+async def stream_answer(command: str, session_id: str, model: str):
+    """Come answer, token per token"""
+    async with llm_admission.slot():
+        prompt, context, emb = await run_in_threadpool(build_prompt, command, session_id)
+        async for token in llm.astream(prompt, embedding=emb, context=context, model=model,
+                                       session=conversation(session_id)):
+            yield token
 
 @app.post("/chat", response_model=ChatResponse)
-def chat(request: ChatRequest, background_tasks: BackgroundTasks):
+async def chat(request: ChatRequest):
     """Endpoint principale per la chat"""
+    start = time.perf_counter()
     command = request.message.strip()
-    command_type = None
+    model = check_model(request.model)
     
     try:
-        # Prova dispatcher semantico ibrido
-        response = dispatch_semantic_hybrid(command)
-        if response:
-            command_type = "semantic"
-        
-        # Fallback su dispatcher tradizionale
-        if response is None:
-            response = dispatch(command)
-            if response:
-                command_type = "traditional"
+        # Dispatcher ed embedding sono CPU-bound: girano sui loro pool, separati dal lavoro per l'LLM
+        response, command_type = await resolve(command)
         
-        # Fallback su LLM
+        # Fallback su LLM, senza occupare un worker durante la generazione
         if response is None:
-            context = sem_mem.search(command)
-            prompt = (f"Contesto precedente: {context}\nDomanda: {command}" if context and context != command else command)
-            response = llm.respond(prompt)
+            await supervisor.require_ready()
+            response = await answer(command, request.session_id, model)
             command_type = "llm"
         
-        # Salva in memoria in background
-        background_tasks.add_task(save_interaction, command, response)
+        # Salva in memoria tramite lo scrittore unico
+        save_interaction(command, response, request.session_id)
+        record_chat("/chat", command_type, start)
         
         return ChatResponse(response=response, command_type=command_type)
         
+    except (AdmissionError, OllamaBusyError) as e:
+        logger.warning(f"LLM saturo: {e}")
+        metrics.inc("dispatch", path="busy")
+        raise overloaded(e)
+    except OllamaUnavailableError as e:
+        logger.warning(f"LLM non pronto: {e}")
+        metrics.inc("dispatch", path="unavailable")
+        raise HTTPException(status_code=503, detail="Modello in avvio, riprova tra poco")
     except Exception as e:
         logger.error(f"Errore durante l'elaborazione: {e}")
+        metrics.inc("dispatch", path="error")
+        raise HTTPException(status_code=500, detail=f"Errore interno: {str(e)}")
+
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """Variante in streaming di /chat (Server-Sent Events, un evento per token)"""
+    start = time.perf_counter()
+    command = request.message.strip()
+    model = check_model(request.model)
+
+    # Comando e sovraccarico si decidono prima di aprire lo stream, così il rifiuto è un vero 429
+    try:
+        resolved = await resolve(command)
+        if resolved[0] is None:
+            llm_admission.check()
+    except AdmissionError as e:
+        metrics.inc("dispatch", path="busy")
+        raise overloaded(e)
+
+    async def events():
+        chunks = []
+        command_type = resolved[1] or "llm"
+        try:
+            async for command_type, chunk in stream_chat(command, request.session_id, model, resolved):
+                chunks.append(chunk)
+                yield f"data: {json.dumps({'token': chunk}, ensure_ascii=False)}\n\n"
+        except Exception as e:
+            logger.error(f"Errore durante lo streaming: {e}")
+            metrics.inc("dispatch", path="error")
+            error = {"detail": str(e)}
+            if isinstance(e, (AdmissionError, OllamaBusyError)):
+                error["retry_after"] = retry_after(e)
+            yield f"event: error\ndata: {json.dumps(error, ensure_ascii=False)}\n\n"
+            return
+
+        response = "".join(chunks)
+        yield f"event: end\ndata: {json.dumps({'command_type': command_type}, ensure_ascii=False)}\n\n"
+        save_interaction(command, response, request.session_id)
+        record_chat("/chat/stream", command_type, start)
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+async def process_batch(messages: List[str], save: bool = False,
+                        session_id: str = DEFAULT_NAMESPACE, model: str = None,
+                        run_commands: bool = False) -> List[ChatResponse]:
+    """
+    Elabora più messaggi insieme: un solo encode batch, matching dei comandi vettoriale,
+    una sola ricerca FAISS e fallback LLM concorrenti (al massimo BATCH_LLM_CONCURRENCY),
+    con priorità più bassa delle richieste interattive.
+    Senza run_commands i comandi con effetti (timer) sono riconosciuti ma non eseguiti.
+    """
+    commands = [message.strip() for message in messages]
+    embs = await run_in_threadpool(embeddings.embed_many, commands)
+
+    with metrics.timer("dispatch_semantic"):
+        responses = await run_in_threadpool(dispatch_semantic_hybrid_batch, commands, input_embs=embs,
+                                            side_effects=run_commands)
+    command_types = ["semantic" if response else None for response in responses]
+    for i, command in enumerate(commands):
+        if responses[i] is None:
+            responses[i] = dispatch(command)
+            if responses[i]:
+                command_types[i] = "traditional"
+
+    # Fallback su LLM per i messaggi rimasti senza risposta
+    pending = [i for i, response in enumerate(responses) if response is None]
+    if pending and not await supervisor.wait_ready():
+        for i in pending:
+            responses[i], command_types[i] = "❌ Errore: modello in avvio, riprova tra poco", "error"
+        pending = []
+    if pending:
+        sem_mem = (await run_in_threadpool(namespaces.get, session_id)).sem_mem
+        with metrics.timer("retrieval"):
+            contexts = await run_in_threadpool(sem_mem.context_batch, [commands[i] for i in pending],
+                                               embs=embs[pending])
+        limit = asyncio.Semaphore(BATCH_LLM_CONCURRENCY)
+
+        async def generate(i: int, context: str):
+            async with limit, llm_admission.slot(PRIORITY_BATCH):
+                return await llm.arespond(format_prompt(commands[i], context), embedding=embs[i], context=context,
+                                         model=model)
+
+        outputs = await asyncio.gather(*(generate(i, context) for i, context in zip(pending, contexts)),
+                                       return_exceptions=True)
+        for i, output in zip(pending, outputs):
+            if isinstance(output, Exception):
+                logger.error(f"Errore nella generazione batch: {output}")
+                responses[i], command_types[i] = f"❌ Errore: {output}", "error"
+            else:
+                responses[i], command_types[i] = output, "llm"
+
+    for command_type in command_types:
+        metrics.inc("dispatch", path=command_type)
+
+    if save:
+        for command, response, command_type in zip(commands, responses, command_types):
+            if command_type != "error":
+                save_interaction(command, response, session_id)
+
+    return [ChatResponse(response=response, command_type=command_type)
+            for response, command_type in zip(responses, command_types)]
+
+@app.post("/chat/batch", response_model=BatchChatResponse)
+async def chat_batch(request: BatchChatRequest):
+    """Elaborazione in blocco di molti messaggi (replay, valutazione, regressioni)"""
+    model = check_model(request.model)
+    try:
+        return BatchChatResponse(results=await process_batch(request.messages, save=request.save,
+                                                           session_id=request.session_id, model=model,
+                                                           run_commands=request.run_commands))
+    except Exception as e:
+        logger.error(f"Errore durante l'elaborazione batch: {e}")
         raise HTTPException(status_code=500, detail=f"Errore interno: {str(e)}")
 
 @app.post("/correction")
 def add_correction(request: CorrectionRequest):
     """Aggiungi una correzione alla memoria semantica"""
     try:
-        sem_mem.learn(request.old_phrase, request.new_phrase)
+        if namespaces.read_only:
+            # Worker in sola lettura: la correzione la applica lo scrittore
+            memory_writer.submit_correction(namespaces.validate(request.session_id),
+                                            request.old_phrase, request.new_phrase)
+        else:
+            namespaces.get(request.session_id).sem_mem.learn(request.old_phrase, request.new_phrase)
         logger.info(f"Correzione registrata: '{request.old_phrase}' -> '{request.new_phrase}'")
         return {"message": "✅ Correzione registrata con successo"}
     except Exception as e:
         logger.error(f"Errore nella registrazione della correzione: {e}")
         raise HTTPException(status_code=500, detail=f"Errore nella correzione: {str(e)}")
 
+@app.get("/timers")
+def list_timers():
+    """Timer in sospeso"""
+    try:
+        return {"timers": scheduler.list()}
+    except WriterUnavailableError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+@app.delete("/timers/{timer_id}")
+def cancel_timer(timer_id: str):
+    """Annulla un timer"""
+    try:
+        cancelled = scheduler.cancel(timer_id)
+    except WriterUnavailableError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    if not cancelled:
+        raise HTTPException(status_code=404, detail="Timer non trovato")
+    return {"message": "✅ Timer annullato"}
+
 @app.get("/history")
-def get_history(limit: int = 10):
-    """Ottieni la cronologia delle conversazioni"""
+def get_history(limit: int = 10, session_id: str = Query(DEFAULT_NAMESPACE, pattern=SESSION_ID_PATTERN)):
+    """Ottieni la cronologia delle conversazioni della sessione"""
     try:
-        history = memory.get("history", [])
-        return {"history": history[-limit:] if limit > 0 else history}
+        history = namespaces.get(session_id).history
+        return {"history": history.tail(limit) if limit > 0 else list(history)}
     except Exception as e:
         logger.error(f"Errore nel recupero della cronologia: {e}")
         raise HTTPException(status_code=500, detail="Errore nel recupero della cronologia")
 
-def save_interaction(command: str, response: str):
-    """Salva l'interazione in memoria (eseguita in background)"""
+def record_chat(endpoint: str, command_type: str, start: float):
+    """Latenza complessiva per endpoint e tipo di comando, più il contatore dei percorsi di dispatch"""
+    metrics.observe("chat_seconds", time.perf_counter() - start, endpoint=endpoint, command_type=command_type)
+    metrics.inc("dispatch", path=command_type)
+
+def save_interaction(command: str, response: str, session_id: str = DEFAULT_NAMESPACE):
+    """Accoda l'interazione allo scrittore della memoria (salvataggio a batch in background)"""
     try:
-        sem_mem.add(command)
-        memory["history"].append({"user": command, "ai": response})
-        save_memory(memory)
-        logger.debug("Interazione salvata in memoria")
+        # Il namespace lo risolve lo scrittore nel suo thread (caricarlo bloccherebbe l'event loop)
+        memory_writer.submit(session_id, command, response)
     except Exception as e:
         logger.error(f"Errore nel salvataggio: {e}")
 
@@ -0,0 +1,93 @@
+# common.py
+
+import os
+import re
+import sys
+import json
+import time
+import platform
+import subprocess
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def percentiles(samples) -> dict:
+    """Riassunto di una serie di durate (secondi) in millisecondi"""
+    if len(samples) == 0:
+        return {"count": 0}
+    values = np.asarray(samples, dtype="float64") * 1000
+    p50, p95, p99 = np.percentile(values, [50, 95, 99]).tolist()
+    return {
+        "count": len(values),
+        "mean_ms": round(float(values.mean()), 3),
+        "p50_ms": round(p50, 3),
+        "p95_ms": round(p95, 3),
+        "p99_ms": round(p99, 3),
+        "max_ms": round(float(values.max()), 3),
+    }
+
+def rss_bytes(pid: int = None):
+    """Memoria residente attuale del processo (None se non misurabile su questa piattaforma)"""
+    try:
+        with open(f"/proc/{pid or 'self'}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import psutil
+        return psutil.Process(pid).memory_info().rss
+    except Exception:
+        return None
+
+def stage_percentiles(snapshot: dict) -> dict:
+    """Quantili per fase da metrics.snapshot(), in millisecondi"""
+    stages = {}
+    for histogram in snapshot["histograms"]:
+        if histogram["name"] != "stage_seconds":
+            continue
+        stages[histogram["labels"]["stage"]] = {
+            "count": histogram["count"],
+            **{key + "_ms": round(histogram[key] * 1000, 3) for key in ("p50", "p95", "p99") if key in histogram},
+        }
+    return stages
+
+_quantile_line = re.compile(r'^assistant_stage_seconds_quantile\{stage="([^"]+)",quantile="([0-9.]+)"\} (\S+)$')
+
+def parse_stage_quantiles(text: str) -> dict:
+    """Quantili per fase dal testo di /metrics, in millisecondi"""
+    stages = {}
+    for line in text.splitlines():
+        match = _quantile_line.match(line)
+        if match:
+            stage, quantile, value = match.groups()
+            stages.setdefault(stage, {})[f"p{round(float(quantile) * 100)}_ms"] = round(float(value) * 1000, 3)
+    return stages
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                              capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+def environment() -> dict:
+    """Metadati dell'esecuzione, per confrontare run diversi"""
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git": git_revision(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+def write_results(results: dict, path: str = None):
+    """Scrive i risultati in JSON su file o, se path è None, su stdout"""
+    data = json.dumps(results, indent=2, ensure_ascii=False)
+    if path is None:
+        print(data)
+        return
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(data + "\n")
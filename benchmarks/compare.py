@@ -0,0 +1,62 @@
+# compare.py
+
+import sys
+import json
+import argparse
+
+THRESHOLD = 0.10   # peggioramento relativo oltre il quale si segnala una regressione
+
+# Metriche confrontate: le latenze devono scendere, il throughput salire
+LOWER_IS_BETTER  = ("p50_ms", "p95_ms", "p99_ms", "mean_ms")
+HIGHER_IS_BETTER = ("throughput_rps",)
+
+def flatten(data: dict, prefix: str = "") -> dict:
+    """{"a": {"b": 1}} -> {"a.b": 1}, solo valori numerici"""
+    flat = {}
+    for key, value in data.items():
+        path = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(flatten(value, path))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+def compare(baseline: dict, current: dict, threshold: float = THRESHOLD) -> list:
+    """Righe (metrica, prima, dopo, variazione, regressione) per le metriche presenti in entrambi i run"""
+    before, after = flatten(baseline["results"]), flatten(current["results"])
+    rows = []
+    for path in sorted(before.keys() & after.keys()):
+        metric = path.rsplit(".", 1)[-1]
+        if metric not in LOWER_IS_BETTER and metric not in HIGHER_IS_BETTER:
+            continue
+        old, new = before[path], after[path]
+        if old == 0:
+            continue
+        change = (new - old) / old
+        worse = change > threshold if metric in LOWER_IS_BETTER else change < -threshold
+        rows.append((path, old, new, change, worse))
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Confronta due run dei benchmark e segnala le regressioni")
+    parser.add_argument("baseline", help="JSON del run di riferimento")
+    parser.add_argument("current", help="JSON del run da verificare")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD, help="peggioramento relativo tollerato")
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+
+    rows = compare(baseline, current, args.threshold)
+    for path, old, new, change, worse in rows:
+        flag = "❌" if worse else "  "
+        print(f"{flag} {path:<60} {old:>12.3f} -> {new:>12.3f} ({change:+.1%})")
+
+    regressions = sum(worse for *_, worse in rows)
+    print(f"\n{len(rows)} metriche confrontate, {regressions} regressioni oltre {args.threshold:.0%}")
+    sys.exit(1 if regressions else 0)
+
+if __name__ == "__main__":
+    main()
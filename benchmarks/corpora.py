@@ -0,0 +1,77 @@
+# corpora.py
+
+import random
+
+SEED = 42
+
+NUMBERS = (1, 2, 3, 5, 10, 15, 20, 30, 45)
+UNITS   = ("secondi", "minuti", "ore")
+CITIES  = ("Roma", "Milano", "Napoli", "Torino", "Bologna", "Firenze", "Palermo", "Genova")
+TOPICS  = ("la fotosintesi", "il Rinascimento", "le reti neurali", "la Divina Commedia", "il ciclo dell'acqua",
+           "la pasta alla carbonara", "l'Impero romano", "i buchi neri", "la dieta mediterranea",
+           "la Costituzione italiana", "il risparmio energetico", "la storia del calcio")
+PEOPLE  = ("Dante", "Leonardo da Vinci", "Galileo", "Maria Montessori", "Enrico Fermi", "Rita Levi-Montalcini")
+
+# Frasi che devono attivare un comando (dispatcher semantico o tradizionale)
+COMMAND_TEMPLATES = (
+    "setta un timer di {n} {unit}",
+    "imposta timer {n} {unit}",
+    "avvia un timer per {n} {unit}",
+    "ricordami tra {n} {unit}",
+    "svegliami tra {n} {unit}",
+    "apri il calendario",
+    "mostra calendario di oggi",
+    "cosa ho in agenda",
+    "che meteo fa a {city}",
+    "meteo di domani a {city}",
+    "ripeti {topic}",
+)
+
+# Domande libere che finiscono all'LLM
+CHAT_TEMPLATES = (
+    "cosa sai di {topic}?",
+    "spiegami {topic} in poche parole",
+    "chi era {person}?",
+    "perché è importante {topic}?",
+    "dammi tre curiosità su {topic}",
+    "come spiegheresti {topic} a un bambino?",
+    "quali libri consigli su {topic}?",
+    "cosa pensava {person} di {topic}?",
+)
+
+# Frasi da salvare in memoria per i test di ricerca
+MEMORY_TEMPLATES = (
+    "ho parlato di {topic} con {person}",
+    "mi interessa {topic}",
+    "domani vado a {city} per {topic}",
+    "ricorda che {person} ha scritto su {topic}",
+    "la settimana scorsa a {city} si parlava di {topic}",
+)
+
+def _fill(template: str, rng: random.Random) -> str:
+    return template.format(n=rng.choice(NUMBERS), unit=rng.choice(UNITS), city=rng.choice(CITIES),
+                           topic=rng.choice(TOPICS), person=rng.choice(PEOPLE))
+
+def commands(n: int, seed: int = SEED) -> list:
+    """n frasi di comando"""
+    rng = random.Random(seed)
+    return [_fill(rng.choice(COMMAND_TEMPLATES), rng) for _ in range(n)]
+
+def chats(n: int, seed: int = SEED) -> list:
+    """n domande per l'LLM"""
+    rng = random.Random(seed + 1)
+    return [_fill(rng.choice(CHAT_TEMPLATES), rng) for _ in range(n)]
+
+def mixed(n: int, command_ratio: float = 0.3, seed: int = SEED) -> list:
+    """n messaggi come in uso reale: una parte di comandi, il resto domande libere"""
+    rng = random.Random(seed + 2)
+    n_commands = round(n * command_ratio)
+    messages = commands(n_commands, seed) + chats(n - n_commands, seed)
+    rng.shuffle(messages)
+    return messages
+
+def memories(n: int, seed: int = SEED):
+    """n frasi distinte da salvare in memoria (generatore, per store molto grandi)"""
+    rng = random.Random(seed + 3)
+    for i in range(n):
+        yield f"{_fill(rng.choice(MEMORY_TEMPLATES), rng)} (#{i})"
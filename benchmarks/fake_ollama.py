@@ -0,0 +1,132 @@
+# fake_ollama.py
+
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+HOST        = "127.0.0.1"
+PORT        = 11434    # la stessa di Ollama: l'assistente la usa senza configurazione
+LATENCY     = 0.2      # secondi prima del primo token (valutazione del prompt)
+TOKEN_RATE  = 50.0     # token al secondo
+TOKENS      = 40       # token per risposta
+
+WORDS = ("certo", "ecco", "la", "risposta", "alla", "tua", "domanda", "in", "breve", "e", "con",
+         "qualche", "dettaglio", "in", "più", "spero", "che", "ti", "sia", "utile")
+
+class FakeOllama:
+    """
+    Sostituto locale di Ollama per i benchmark: implementa GET / e POST /api/generate
+    (streaming NDJSON o risposta singola) con latenza iniziale e velocità dei token configurabili.
+    """
+
+    def __init__(self, host: str = HOST, port: int = PORT, latency: float = LATENCY,
+                 token_rate: float = TOKEN_RATE, tokens: int = TOKENS):
+        self.latency    = latency
+        self.token_rate = token_rate
+        self.tokens     = tokens
+        self.requests   = 0
+        self._server    = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread    = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-ollama", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def words(self, prompt: str):
+        """Token della risposta: deterministici, dipendono solo dal prompt"""
+        offset = sum(map(ord, prompt)) % len(WORDS)
+        return [WORDS[(offset + i) % len(WORDS)] for i in range(self.tokens)]
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status: int, body: bytes, content_type: str = "application/json"):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _chunk(self, obj: dict):
+                data = (json.dumps(obj) + "\n").encode("utf-8")
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                self.wfile.flush()
+
+            def do_GET(self):
+                self._send(200, b"Ollama is running", "text/plain")
+
+            def do_POST(self):
+                if self.path != "/api/generate":
+                    self._send(404, b'{"error": "not found"}')
+                    return
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length) or b"{}")
+                fake.requests += 1
+                model = body.get("model", "")
+
+                # Senza prompt Ollama carica soltanto il modello
+                if not body.get("prompt"):
+                    self._send(200, json.dumps({"model": model, "response": "", "done": True}).encode("utf-8"))
+                    return
+
+                words = fake.words(body["prompt"])
+                final = {"model": model, "response": "", "done": True,
+                         "context": list(range(len(words))), "eval_count": len(words)}
+                time.sleep(fake.latency)
+
+                if not body.get("stream", True):
+                    time.sleep(len(words) / fake.token_rate)
+                    self._send(200, json.dumps({**final, "response": " ".join(words)}).encode("utf-8"))
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for i, word in enumerate(words):
+                    self._chunk({"model": model, "response": (" " if i else "") + word, "done": False})
+                    time.sleep(1 / fake.token_rate)
+                self._chunk(final)
+                self.wfile.write(b"0\r\n\r\n")
+                self.wfile.flush()
+
+        return Handler
+
+def main():
+    parser = argparse.ArgumentParser(description="Ollama finto per i benchmark")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--latency", type=float, default=LATENCY, help="secondi prima del primo token")
+    parser.add_argument("--token-rate", type=float, default=TOKEN_RATE, help="token al secondo")
+    parser.add_argument("--tokens", type=int, default=TOKENS, help="token per risposta")
+    args = parser.parse_args()
+
+    fake = FakeOllama(args.host, args.port, args.latency, args.token_rate, args.tokens).start()
+    print(f"🦙 Ollama finto in ascolto su {fake.url} (Ctrl+C per uscire)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        fake.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+# run.py
+
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import logging
+import argparse
+import tempfile
+import subprocess
+
+import httpx
+
+from benchmarks import corpora
+from benchmarks.common import (REPO_ROOT, percentiles, rss_bytes, stage_percentiles,
+                               parse_stage_quantiles, environment, write_results)
+from benchmarks.fake_ollama import FakeOllama, LATENCY, TOKEN_RATE, TOKENS
+from benchmarks.seed_memory import SIZES, seed_store
+
+try:
+    import websockets
+except ImportError:
+    websockets = None
+
+logger = logging.getLogger(__name__)
+
+SCENARIOS   = ("components", "cli", "api", "ws")
+REQUESTS    = 200
+CONCURRENCY = 8
+API_PORT    = 8765
+READY_TIMEOUT = 120.0   # secondi concessi al server per caricare modello e memoria
+
+class NullTimers:
+    """
+    Timer degli scenari in processo: i comandi del corpus non programmano timer veri
+    (niente timers.json, niente notifiche); si installa con scheduler.use_remote
+    """
+
+    def schedule(self, seconds: float, message: str) -> dict:
+        return {"id": "benchmark", "due": time.time() + seconds, "seconds": seconds, "message": message}
+
+    def cancel(self, timer_id: str) -> bool:
+        return False
+
+    def list(self) -> list:
+        return []
+
+# ---------- componenti (in processo) ----------
+def run_components(n: int) -> dict:
+    """Latenze dei singoli passi: dispatch, embedding, ricerca FAISS, contesto e salvataggio"""
+    import embeddings
+    from metrics import metrics
+    from commands.registry import dispatch_semantic_hybrid
+    from memory.memory import HistoryStore
+    from memory.semantic_memory import SemanticMemory
+
+    commands, chats = corpora.commands(n), corpora.chats(n)
+    sem_mem = SemanticMemory()
+    history = HistoryStore()
+    embeddings.embed_many(commands[:1])   # carica il modello fuori dalle misure
+    dispatch_semantic_hybrid(commands[0])
+    metrics.reset()
+
+    samples = {"dispatch": [], "embed": [], "search": [], "context": [], "save_interaction": []}
+    for command in commands:
+        start = time.perf_counter()
+        dispatch_semantic_hybrid(command)
+        samples["dispatch"].append(time.perf_counter() - start)
+
+    embeddings.clear_cache()
+    for chat in chats:
+        start = time.perf_counter()
+        emb = embeddings.embed(chat)
+        samples["embed"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        sem_mem.search(chat, emb=emb)
+        samples["search"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        sem_mem.context(chat, emb=emb)
+        samples["context"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        sem_mem.add(chat, emb=emb)
+        history.append({"user": chat, "ai": ""})
+        samples["save_interaction"].append(time.perf_counter() - start)
+
+    result = {name: percentiles(values) for name, values in samples.items()}
+    result["memory_entries"] = len(sem_mem.id_map)
+    result["stages"] = stage_percentiles(metrics.snapshot())
+    result["rss_bytes"] = rss_bytes()
+    sem_mem.close()
+    return result
+
+# ---------- CLI (in processo) ----------
+def run_cli(n: int) -> dict:
+    """Il ciclo di main.py: stream della risposta stampata token per token, poi salvataggio"""
+    import main
+    from metrics import metrics
+    from llm_wrapper import LocalLLM
+    from response_cache import ResponseCache
+    from memory.memory import HistoryStore
+    from memory.semantic_memory import SemanticMemory
+
+    main.sem_mem = SemanticMemory()
+    main.llm     = LocalLLM(cache=ResponseCache())
+    main.history = HistoryStore()
+    main.supervisor.start()
+    main.supervisor.wait_ready_sync(READY_TIMEOUT)
+    main.llm.warm_up()
+    metrics.reset()
+
+    first_token, total = [], []
+    started = time.perf_counter()
+    for message in corpora.mixed(n):
+        start = time.perf_counter()
+        chunks = []
+        for chunk in main.stream_command(message):
+            if not chunks:
+                first_token.append(time.perf_counter() - start)
+            chunks.append(chunk)
+        main.sem_mem.add(message)
+        main.history.append({"user": message, "ai": "".join(chunks)})
+        total.append(time.perf_counter() - start)
+    elapsed = time.perf_counter() - started
+
+    main.supervisor.stop()
+    main.sem_mem.close()
+    return {
+        "first_token": percentiles(first_token),
+        "total": percentiles(total),
+        "throughput_rps": round(n / elapsed, 2),
+        "stages": stage_percentiles(metrics.snapshot()),
+        "rss_bytes": rss_bytes(),
+    }
+
+# ---------- server HTTP (processo separato) ----------
+def start_server(workdir: str, port: int) -> subprocess.Popen:
+    """Avvia uvicorn sull'app nella cartella di lavoro e attende che sia pronto"""
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [REPO_ROOT, os.environ.get("PYTHONPATH")]))}
+    process = subprocess.Popen([sys.executable, "-m", "uvicorn", "api_server:app", "--port", str(port),
+                                "--log-level", "warning"], cwd=workdir, env=env)
+    deadline = time.monotonic() + READY_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Il server è terminato durante l'avvio (codice {process.returncode})")
+        try:
+            res = httpx.get(f"http://127.0.0.1:{port}/health/ready", timeout=2)
+            if res.status_code == 200 and res.json().get("embeddings_loaded"):
+                return process
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    stop_server(process)
+    raise RuntimeError("Il server non è diventato pronto in tempo")
+
+def stop_server(process: subprocess.Popen):
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+async def run_api(port: int, n: int, concurrency: int, server_pid: int) -> dict:
+    """POST /chat con `concurrency` richieste in parallelo"""
+    base_url = f"http://127.0.0.1:{port}"
+    messages = corpora.mixed(n)
+    latencies, statuses = [], {}
+    limit = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=300) as client:
+        async def send(message: str):
+            async with limit:
+                start = time.perf_counter()
+                res = await client.post("/chat", json={"message": message})
+                latencies.append(time.perf_counter() - start)
+                statuses[res.status_code] = statuses.get(res.status_code, 0) + 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(send(message) for message in messages))
+        elapsed = time.perf_counter() - started
+        metrics_text = (await client.get("/metrics")).text
+
+    return {
+        "latency": percentiles(latencies),
+        "throughput_rps": round(n / elapsed, 2),
+        "status": {str(code): count for code, count in sorted(statuses.items())},
+        "stages": parse_stage_quantiles(metrics_text),
+        "server_rss_bytes": rss_bytes(server_pid),
+    }
+
+async def run_ws(port: int, n: int, concurrency: int, server_pid: int) -> dict:
+    """Una connessione WebSocket per client, messaggi in sequenza su ciascuna"""
+    if websockets is None:
+        return {"skipped": "pacchetto websockets non installato"}
+
+    messages = corpora.mixed(n)
+    first_token, total, errors = [], [], 0
+
+    async def client(i: int, batch: list):
+        nonlocal errors
+        async with websockets.connect(f"ws://127.0.0.1:{port}/ws?session_id=bench-{i}", max_size=None) as ws:
+            for message in batch:
+                start = time.perf_counter()
+                first = None
+                await ws.send(message)
+                while True:
+                    try:
+                        frame = json.loads(await ws.recv())
+                    except json.JSONDecodeError:
+                        continue   # notifiche in testo semplice (es. timer)
+                    if not isinstance(frame, dict):
+                        continue
+                    if frame.get("type") == "token" and first is None:
+                        first = time.perf_counter() - start
+                    elif frame.get("type") in ("end", "error"):
+                        errors += frame["type"] == "error"
+                        break
+                total.append(time.perf_counter() - start)
+                if first is not None:
+                    first_token.append(first)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client(i, messages[i::concurrency]) for i in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "first_token": percentiles(first_token),
+        "total": percentiles(total),
+        "throughput_rps": round(n / elapsed, 2),
+        "errors": errors,
+        "server_rss_bytes": rss_bytes(server_pid),
+    }
+
+# ---------- orchestrazione ----------
+def run_store(size: str, args) -> dict:
+    """Tutti gli scenari richiesti su una copia dello store seminato (l'originale resta intatto)"""
+    store = seed_store(size, args.index_type, args.real_embeddings)
+    workdir = tempfile.mkdtemp(prefix=f"assistant-bench-{size}-")
+    shutil.copytree(store, os.path.join(workdir, "memory", "memory_store"))
+    previous_cwd = os.getcwd()
+    os.chdir(workdir)   # i percorsi della memoria sono relativi alla cartella corrente
+    results = {}
+    from commands.scheduler import scheduler
+    scheduler.use_remote(NullTimers())
+    try:
+        if "components" in args.scenario:
+            logger.info(f"⏱️ [{size}] componenti")
+            results["components"] = run_components(args.requests)
+        if "cli" in args.scenario:
+            logger.info(f"⏱️ [{size}] CLI")
+            results["cli"] = run_cli(args.requests)
+        if "api" in args.scenario or "ws" in args.scenario:
+            server = start_server(workdir, args.port)
+            try:
+                if "api" in args.scenario:
+                    logger.info(f"⏱️ [{size}] API HTTP")
+                    results["api"] = asyncio.run(run_api(args.port, args.requests, args.concurrency, server.pid))
+                if "ws" in args.scenario:
+                    logger.info(f"⏱️ [{size}] WebSocket")
+                    results["ws"] = asyncio.run(run_ws(args.port, args.requests, args.concurrency, server.pid))
+            finally:
+                stop_server(server)
+    finally:
+        scheduler.use_remote(None)
+        os.chdir(previous_cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark end-to-end dell'assistente con un Ollama finto")
+    parser.add_argument("--store", choices=SIZES, action="append", help="dimensione della memoria (ripetibile, default 1k)")
+    parser.add_argument("--scenario", choices=SCENARIOS, action="append", help="scenario (ripetibile, default tutti)")
+    parser.add_argument("--requests", type=int, default=REQUESTS, help="messaggi per scenario")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY, help="client contemporanei (API e WebSocket)")
+    parser.add_argument("--index-type", default="flat", choices=("flat", "hnsw", "ivf"))
+    parser.add_argument("--real-embeddings", action="store_true", help="seed con il modello di embeddings vero")
+    parser.add_argument("--latency", type=float, default=LATENCY, help="Ollama finto: secondi prima del primo token")
+    parser.add_argument("--token-rate", type=float, default=TOKEN_RATE, help="Ollama finto: token al secondo")
+    parser.add_argument("--tokens", type=int, default=TOKENS, help="Ollama finto: token per risposta")
+    parser.add_argument("--port", type=int, default=API_PORT, help="porta del server API di prova")
+    parser.add_argument("--output", help="file JSON dei risultati (default stdout)")
+    args = parser.parse_args()
+    args.store = args.store or ["1k"]
+    args.scenario = args.scenario or list(SCENARIOS)
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+    sys.path.insert(0, REPO_ROOT)
+    try:
+        fake = FakeOllama(latency=args.latency, token_rate=args.token_rate, tokens=args.tokens).start()
+    except OSError as e:
+        parser.error(f"porta di Ollama occupata ({e}): fermare Ollama prima dei benchmark")
+
+    try:
+        results = {
+            "meta": {**environment(), "params": {key: value for key, value in vars(args).items() if key != "output"}},
+            "results": {size: run_store(size, args) for size in args.store},
+        }
+    finally:
+        fake.stop()
+    write_results(results, args.output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+# seed_memory.py
+
+import os
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import itertools
+
+import numpy as np
+
+from benchmarks import corpora
+
+logger = logging.getLogger(__name__)
+
+SIZES = {"1k": 1_000, "100k": 100_000, "1m": 1_000_000}
+STORES_DIR = os.path.join(tempfile.gettempdir(), "assistant-bench", "stores")
+CHUNK = 50_000
+DIM   = 384
+
+def store_path(size: str, index_type: str = "flat", real_embeddings: bool = False) -> str:
+    suffix = "-real" if real_embeddings else ""
+    return os.path.join(STORES_DIR, f"{size}-{index_type}{suffix}")
+
+def seed_store(size: str, index_type: str = "flat", real_embeddings: bool = False, force: bool = False) -> str:
+    """
+    Crea (una volta sola) uno store di memoria semantica con SIZES[size] frasi e ne restituisce
+    la cartella. Di default i vettori sono casuali: per 100k/1M calcolare gli embeddings veri
+    richiederebbe ore, mentre i tempi di ricerca dipendono solo da numero e dimensione dei vettori.
+    """
+    from memory.semantic_memory import SemanticMemory
+
+    path = store_path(size, index_type, real_embeddings)
+    if os.path.exists(path) and not force:
+        return path
+    shutil.rmtree(path, ignore_errors=True)
+
+    n = SIZES[size]
+    rng = np.random.default_rng(corpora.SEED)
+    start = time.perf_counter()
+    sem_mem = SemanticMemory(index_type=index_type, store_dir=path)
+    texts = corpora.memories(n)
+    for done in range(0, n, CHUNK):
+        chunk = list(itertools.islice(texts, CHUNK))
+        embs = None if real_embeddings else rng.standard_normal((len(chunk), DIM), dtype="float32")
+        sem_mem.bulk_load(chunk, embs, save=False)
+        logger.info(f"🌱 {done + len(chunk)}/{n} frasi caricate")
+    sem_mem.close()
+    logger.info(f"✅ Store {size} ({index_type}) pronto in {time.perf_counter() - start:.1f}s: {path}")
+    return path
+
+def main():
+    parser = argparse.ArgumentParser(description="Crea gli store di memoria per i benchmark")
+    parser.add_argument("--size", choices=SIZES, action="append", help="dimensione (ripetibile, default tutte)")
+    parser.add_argument("--index-type", default="flat", choices=("flat", "hnsw", "ivf"))
+    parser.add_argument("--real-embeddings", action="store_true", help="usa il modello di embeddings vero")
+    parser.add_argument("--force", action="store_true", help="ricrea anche gli store esistenti")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    for size in args.size or SIZES:
+        print(seed_store(size, args.index_type, args.real_embeddings, args.force))
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,7 @@
 #custom commands 
 
 import re
-import asyncio
-import threading
-from webSocket import send_ws_message
+from commands.scheduler import scheduler
 
 def set_timer_from_text(command: str) -> str:
     match = re.search(r"(\d+)\s*(minuto|minuti|secondo|secondi)", command)
@@ -15,11 +13,7 @@ def set_timer_from_text(command: str) -> str:
 
     seconds = value * 60 if "minut" in unit else value
 
-    def timer_done():
-        print("\n⏰ Timer terminato!")
-        asyncio.run(send_ws_message("⏰ Il timer è terminato!"))
-
-    threading.Timer(seconds, timer_done).start()
+    scheduler.schedule(seconds, "⏰ Il timer è terminato!")
     return f"⏱️ Timer impostato per {value} {unit}."
 
 def apri_calendario(command: str) -> str:
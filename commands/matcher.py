@@ -0,0 +1,46 @@
+# matcher.py
+
+import re
+
+class KeywordMatcher:
+    """
+    Matcher multi-parola compilato una sola volta: un'unica regex con confini di parola,
+    quindi una sola passata sull'input indipendentemente dal numero di parole chiave
+    ("ora" non corrisponde più dentro "lavora").
+
+    Le chiavi sono parole o frasi; un "*" finale indica una radice ("ricorda*" -> "ricordami").
+    """
+
+    def __init__(self, keywords: dict):
+        self.keywords = dict(keywords)   # {parola chiave: intento}
+        self._groups  = {}               # {nome gruppo: parola chiave}
+
+        alternatives = []
+        # Le chiavi più lunghe prima: "setta timer" vince su "setta"
+        for i, keyword in enumerate(sorted(self.keywords, key=len, reverse=True)):
+            name = f"k{i}"
+            self._groups[name] = keyword
+            alternatives.append(f"(?P<{name}>{self._pattern(keyword)})")
+
+        self._regex = re.compile(r"\b(?:" + "|".join(alternatives) + r")\b", re.IGNORECASE) if alternatives else None
+
+    @staticmethod
+    def _pattern(keyword: str) -> str:
+        stem = keyword.endswith("*")
+        words = keyword.rstrip("*").split()
+        pattern = r"\s+".join(re.escape(word) for word in words)
+        return pattern + r"\w*" if stem else pattern
+
+    def find_all(self, text: str) -> list:
+        """Tutte le corrispondenze in ordine di posizione: [(intento, parola chiave, inizio, fine)]"""
+        if self._regex is None:
+            return []
+        matches = []
+        for match in self._regex.finditer(text):
+            keyword = self._groups[match.lastgroup]
+            matches.append((self.keywords[keyword], keyword, match.start(), match.end()))
+        return matches
+
+    def intents(self, text: str) -> set:
+        """Insieme degli intenti presenti nel testo"""
+        return {intent for intent, _, _, _ in self.find_all(text)}
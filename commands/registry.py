@@ -1,11 +1,12 @@
 # registry.py
 
-from sentence_transformers import SentenceTransformer
 import numpy as np
 import logging
 from functools import lru_cache
 
+import embeddings
 from commands.custom_commands import set_timer_from_text, apri_calendario
+from commands.matcher import KeywordMatcher
 
 # Configurazione logging
 logger = logging.getLogger(__name__)
@@ -29,150 +30,212 @@ COMMANDS = {
     "pianificazione": apri_calendario,
 }
 
-# Cache per modello e embeddings
-_model = None
-_embeddings = {}
+# Parole chiave per il riconoscimento veloce ("*" = radice, es. "ricorda*" -> "ricordami")
+TIMER_WORDS    = ["timer", "setta*", "imposta*", "avvia*", "crea*", "sveglia*", "ricorda*", "tra"]
+DURATION_WORDS = ["secondo", "secondi", "minuto", "minuti", "ora", "ore"]
+CALENDAR_WORDS = ["calendario", "agenda", "pianificazione", "appuntamenti"]
+
+# Intento associato a ogni handler di COMMANDS
+COMMAND_INTENTS = {
+    set_timer_from_text: "timer",
+    apri_calendario: "calendario",
+}
+
+# Handler con effetti oltre alla risposta (programmano un timer): nei batch si eseguono solo su richiesta
+SIDE_EFFECTS = {set_timer_from_text}
+
+def build_intent_matcher() -> KeywordMatcher:
+    """Compila in un unico matcher le frasi di COMMANDS e le parole chiave per intento"""
+    keywords = {phrase: COMMAND_INTENTS[handler] for phrase, handler in COMMANDS.items()}
+    keywords.update({word: "timer" for word in TIMER_WORDS})
+    keywords.update({word: "durata" for word in DURATION_WORDS})
+    keywords.update({word: "calendario" for word in CALENDAR_WORDS})
+    return KeywordMatcher(keywords)
+
+_intent_matcher = build_intent_matcher()
+
+def match_intents(user_input: str) -> set:
+    """Intenti riconosciuti per parola chiave, in una sola passata sull'input"""
+    return _intent_matcher.intents(user_input)
+
+# Frasi dei comandi e matrice (n_frasi, dim) dei loro embeddings normalizzati:
+# il confronto con un input è un solo prodotto matrice-vettore
+_phrases = []
+_matrix = None
 
 def get_model():
-    """Carica il modello sentence transformer (lazy loading)"""
-    global _model
-    if _model is None:
-        try:
-            _model = SentenceTransformer("all-MiniLM-L6-v2")
-            logger.info("✅ Modello sentence transformer caricato")
-        except Exception as e:
-            logger.error(f"❌ Errore caricamento modello: {e}")
-            raise
-    return _model
+    """Modello sentence transformer condiviso (vedi embeddings.get_model)"""
+    return embeddings.get_model()
+
+def _normalize_rows(vectors) -> np.ndarray:
+    """Normalizza ogni riga a norma unitaria (prodotto scalare = similarità coseno)"""
+    vectors = np.atleast_2d(np.asarray(vectors, dtype="float32"))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
 
 def initialize_embeddings():
-    """Inizializza gli embeddings per tutti i comandi"""
-    global _embeddings
-    if not _embeddings:
-        model = get_model()
-        _embeddings = {cmd: model.encode(cmd) for cmd in COMMANDS}
-        logger.info(f"✅ Embeddings inizializzati per {len(_embeddings)} comandi")
+    """Inizializza la matrice degli embeddings per tutti i comandi"""
+    global _phrases, _matrix
+    if _matrix is None:
+        phrases = list(COMMANDS)
+        matrix = _normalize_rows(embeddings.encode(phrases))
+        _phrases = phrases
+        _matrix = matrix
+        logger.info(f"✅ Embeddings inizializzati per {len(_phrases)} comandi")
+
+def score_commands(input_embs) -> np.ndarray:
+    """
+    Similarità coseno tra uno o più input e tutte le frasi dei comandi.
+    Restituisce una matrice (n_input, n_frasi).
+    """
+    initialize_embeddings()
+    return _normalize_rows(input_embs) @ _matrix.T
+
+def match_commands(user_inputs, input_embs=None):
+    """
+    Versione batch del matching semantico: per ogni input restituisce (frase migliore, score).
+    Gli embeddings degli input, se non forniti, vengono calcolati in un'unica chiamata.
+    """
+    if not user_inputs:
+        return []
+    if input_embs is None:
+        input_embs = embeddings.embed_many(user_inputs)
+
+    scores = score_commands(input_embs)
+    best = scores.argmax(axis=1)
+    return [(_phrases[i], float(scores[row, i])) for row, i in enumerate(best)]
+
+def _best_match(user_input: str, input_emb=None):
+    """Frase di comando più simile all'input e relativo score"""
+    if input_emb is None:
+        input_emb = embeddings.embed(user_input)
+    return match_commands([user_input], input_embs=input_emb)[0]
 
 @lru_cache(maxsize=128)
 def cosine_similarity_cached(input_text: str, command: str):
     """Calcola similarità coseno con cache"""
-    model = get_model()
-    if command not in _embeddings:
-        _embeddings[command] = model.encode(command)
-    
-    input_emb = model.encode(input_text)
-    cmd_emb = _embeddings[command]
+    initialize_embeddings()
+    if command in COMMANDS:
+        cmd_emb = _matrix[_phrases.index(command)]
+    else:
+        cmd_emb = embeddings.embed(command)
     
-    return np.dot(input_emb, cmd_emb) / (np.linalg.norm(input_emb) * np.linalg.norm(cmd_emb))
+    return cosine_similarity(embeddings.embed(input_text), cmd_emb)
 
 def cosine_similarity(a, b):
     """Calcola similarità coseno tra due vettori"""
     return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
 
-def dispatch_semantic(user_input: str, threshold: float = 0.65):
+def dispatch_semantic(user_input: str, threshold: float = 0.65, input_emb=None):
     """
     Dispatcher semantico puro basato su embeddings
     """
-    initialize_embeddings()
-    model = get_model()
-    input_emb = model.encode(user_input)
-
-    best_match = None
-    best_score = -1
-    best_command = None
-
-    for cmd, emb in _embeddings.items():
-        sim = cosine_similarity(input_emb, emb)
-        if sim > best_score:
-            best_score = sim
-            best_match = cmd
-            best_command = COMMANDS[cmd]
+    best_match, best_score = _best_match(user_input, input_emb)
 
     logger.debug(f"🔍 Semantic match - Input: '{user_input}' | Best: '{best_match}' | Score: {best_score:.3f}")
 
     if best_score >= threshold:
         logger.info(f"✅ Comando semantico trovato: {best_match}")
-        return best_command(user_input)
+        return COMMANDS[best_match](user_input)
 
     return None
 
-def dispatch_semantic_hybrid(user_input: str, embedding_threshold: float = 0.6):
-    """
-    Dispatcher ibrido migliorato: keyword matching + embeddings con fallback intelligente
-    """
-    user_lower = user_input.lower()
+def _keyword_handler(user_input: str):
+    """Handler del comando riconosciuto per parole chiave, None se nessuno corrisponde"""
+    intents = match_intents(user_input)
     
-    # 1. Pattern matching avanzato per timer
-    timer_patterns = [
-        # Verifica presenza di parole temporali E parole comando
-        (["timer", "setta", "imposta", "avvia", "crea", "sveglia", "ricorda"], 
-        ["secondo", "secondi", "minuto", "minuti", "ora", "ore"]),
-        # Pattern specifici
-        (["tra"], ["secondo", "secondi", "minuto", "minuti", "ora", "ore"])
-    ]
+    # 1. Timer: parola comando E durata
+    if "timer" in intents and "durata" in intents:
+        logger.info("🎯 Timer rilevato tramite pattern matching")
+        return set_timer_from_text
     
-    for cmd_words, time_words in timer_patterns:
-        if (any(word in user_lower for word in cmd_words) and 
-            any(word in user_lower for word in time_words)):
-            logger.info("🎯 Timer rilevato tramite pattern matching")
-            return set_timer_from_text(user_input)
-    
-    # 2. Pattern matching per calendario
-    calendar_patterns = ["calendario", "agenda", "pianificazione", "appuntamenti"]
-    calendar_actions = ["apri", "mostra", "visualizza", "vedi"]
-    
-    if (any(pattern in user_lower for pattern in calendar_patterns) or
-        (any(action in user_lower for action in calendar_actions) and 
-        any(pattern in user_lower for pattern in calendar_patterns))):
+    # 2. Calendario: basta una parola chiave
+    if "calendario" in intents:
         logger.info("🎯 Calendario rilevato tramite pattern matching")
-        return apri_calendario(user_input)
+        return apri_calendario
     
-    # 3. Fallback con embeddings (migliorato)
-    try:
-        initialize_embeddings()
-        model = get_model()
-        input_emb = model.encode(user_input)
-        
-        best_match = None
-        best_score = -1
-        best_command = None
+    return None
+
+def dispatch_keywords(user_input: str):
+    """Riconoscimento veloce per parole chiave, None se nessun comando corrisponde"""
+    handler = _keyword_handler(user_input)
+    return None if handler is None else handler(user_input)
+
+def _run_handler(handler, user_input: str, side_effects: bool = True) -> str:
+    """Esegue il comando; senza side_effects quelli in SIDE_EFFECTS sono solo riconosciuti"""
+    if handler in SIDE_EFFECTS and not side_effects:
+        return f"⏭️ Comando '{COMMAND_INTENTS[handler]}' riconosciuto, non eseguito"
+    return handler(user_input)
+
+def dispatch_semantic_hybrid(user_input: str, embedding_threshold: float = 0.6, input_emb=None):
+    """
+    Dispatcher ibrido migliorato: keyword matching + embeddings con fallback intelligente.
+    input_emb permette di riusare un embedding già calcolato per questo messaggio.
+    """
+    response = dispatch_keywords(user_input)
+    if response is not None:
+        return response
+    return dispatch_embedding(user_input, embedding_threshold, input_emb)
 
-        for cmd, emb in _embeddings.items():
-            sim = cosine_similarity(input_emb, emb)
-            if sim > best_score:
-                best_score = sim
-                best_match = cmd
-                best_command = COMMANDS[cmd]
+def dispatch_embedding(user_input: str, embedding_threshold: float = 0.6, input_emb=None):
+    """Solo il fallback con embeddings di dispatch_semantic_hybrid (un solo prodotto matrice-vettore)"""
+    try:
+        best_match, best_score = _best_match(user_input, input_emb)
 
         logger.debug(f"🔍 Embedding match - Input: '{user_input}' | Best: '{best_match}' | Score: {best_score:.3f}")
 
         if best_score >= embedding_threshold:
             logger.info(f"✅ Comando trovato tramite embeddings: {best_match}")
-            return best_command(user_input)
+            return COMMANDS[best_match](user_input)
     
     except Exception as e:
         logger.error(f"❌ Errore nel matching semantico: {e}")
     
     return None
 
-def get_command_suggestions(user_input: str, top_k: int = 3):
+def dispatch_semantic_hybrid_batch(user_inputs, embedding_threshold: float = 0.6, input_embs=None,
+                                   side_effects: bool = True):
+    """
+    Versione batch di dispatch_semantic_hybrid: parole chiave per ogni input,
+    poi un unico matching vettoriale per tutti quelli rimasti senza comando.
+    Restituisce una risposta (o None) per ogni input. Con side_effects=False i comandi
+    in SIDE_EFFECTS (es. i timer) non si eseguono: la risposta dice solo quale è stato riconosciuto.
+    """
+    handlers = [_keyword_handler(text) for text in user_inputs]
+    pending = [i for i, handler in enumerate(handlers) if handler is None]
+    
+    if pending:
+        try:
+            embs = None if input_embs is None else np.asarray(input_embs)[pending]
+            matches = match_commands([user_inputs[i] for i in pending], input_embs=embs)
+            for i, (best_match, best_score) in zip(pending, matches):
+                if best_score >= embedding_threshold:
+                    handlers[i] = COMMANDS[best_match]
+        
+        except Exception as e:
+            logger.error(f"❌ Errore nel matching semantico batch: {e}")
+    
+    return [None if handler is None else _run_handler(handler, text, side_effects)
+            for handler, text in zip(handlers, user_inputs)]
+
+def get_command_suggestions(user_input: str, top_k: int = 3, input_emb=None):
     """
     Restituisce i migliori match per suggerimenti
     """
     try:
-        initialize_embeddings()
-        model = get_model()
-        input_emb = model.encode(user_input)
+        if input_emb is None:
+            input_emb = embeddings.embed(user_input)
         
-        similarities = []
-        for cmd, emb in _embeddings.items():
-            sim = cosine_similarity(input_emb, emb)
-            similarities.append((cmd, sim))
+        scores = score_commands(input_emb)[0]
+        top_k = min(top_k, len(scores))
+        if top_k <= 0:
+            return []
         
-        # Ordina per similarità decrescente
-        similarities.sort(key=lambda x: x[1], reverse=True)
+        # Selezione parziale dei top_k, poi ordinamento per similarità decrescente
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        top = top[np.argsort(-scores[top])]
         
-        return similarities[:top_k]
+        return [(_phrases[i], float(scores[i])) for i in top]
     
     except Exception as e:
         logger.error(f"Errore nel calcolo suggerimenti: {e}")
@@ -180,7 +243,9 @@ def get_command_suggestions(user_input: str, top_k: int = 3):
 
 def clear_cache():
     """Pulisce la cache (utile per development)"""
-    global _embeddings
-    _embeddings.clear()
+    global _phrases, _matrix
+    _phrases = []
+    _matrix = None
     cosine_similarity_cached.cache_clear()
+    embeddings.clear_cache()
     logger.info("🧹 Cache embeddings pulita")
\ No newline at end of file
@@ -0,0 +1,253 @@
+# scheduler.py
+
+import os
+import json
+import time
+import heapq
+import uuid
+import asyncio
+import logging
+import threading
+from pathlib import Path
+
+from webSocket import send_ws_message
+
+# Configurazione logging
+logger = logging.getLogger(__name__)
+
+TIMERS_PATH = Path("memory/timers.json")
+
+# Ogni modifica è un record in coda al journal (memory/timers.log), non una riscrittura di
+# timers.json: il journal si compatta nello snapshot, in background, quando i suoi record
+# superano i timer in sospeso (e almeno COMPACT_MIN), quindi il costo per modifica resta costante
+COMPACT_MIN   = 256
+COMPACT_RATIO = 1.0
+
+class TimerScheduler:
+    """
+    Scheduler centrale dei timer: un heap ordinato per scadenza e un solo task
+    sull'event loop del server (o su un loop dedicato in un thread, per la CLI).
+    I timer in sospeso sono salvati su disco (snapshot più journal) e ripristinati al riavvio.
+    Con più worker lo scheduler gira solo in quello che scrive la memoria: gli altri
+    gli inoltrano le chiamate tramite use_remote.
+    """
+
+    def __init__(self, path: Path = TIMERS_PATH):
+        self.path    = Path(path)
+        self.journal_path = self.path.with_suffix(".log")
+        self._journal = None   # aperto alla prima modifica
+        self._journal_records = 0
+        self._compacting = False
+        self._heap   = []      # [(scadenza epoch, id)]
+        self._timers = {}      # {id: {"id", "due", "seconds", "message"}}
+        self._lock   = threading.Lock()
+        self._loop   = None
+        self._task   = None
+        self._wakeup = None
+        self._remote = None    # timer gestiti da un altro processo (schedule/cancel/list)
+        self._listeners = []   # coroutine chiamate con ogni timer che suona
+        self._load()
+
+    # ---------- ciclo di vita ----------
+    def start(self, loop: asyncio.AbstractEventLoop = None):
+        """Avvia lo scheduler sul loop dato, oppure su un loop dedicato in background"""
+        if self._loop is not None:
+            return
+        if loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="timer-scheduler", daemon=True).start()
+        self._loop = loop
+        self._task = asyncio.run_coroutine_threadsafe(self._run(), loop)
+        logger.info(f"⏱️ Scheduler timer avviato ({len(self._timers)} timer in sospeso)")
+
+    def use_remote(self, remote):
+        """Inoltra schedule, cancel e list a `remote` invece di gestire i timer qui"""
+        self._remote = remote
+
+    def add_listener(self, callback):
+        """Registra una coroutine da chiamare con ogni timer che suona"""
+        self._listeners.append(callback)
+
+    def stop(self):
+        """Ferma lo scheduler (i timer restano salvati per il prossimo avvio)"""
+        if self._task is not None:
+            self._task.cancel()
+        self._loop = None
+        self._task = None
+        self._wakeup = None
+
+    def _notify(self):
+        """Sveglia il task dello scheduler da qualsiasi thread"""
+        loop, wakeup = self._loop, self._wakeup
+        if loop is not None and wakeup is not None:
+            loop.call_soon_threadsafe(wakeup.set)
+
+    async def _run(self):
+        self._wakeup = asyncio.Event()
+        while True:
+            self._wakeup.clear()
+            delay = self._seconds_to_next()
+            if delay is None or delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+            for timer in self._pop_due():
+                await self._fire(timer)
+
+    async def _fire(self, timer: dict):
+        logger.info(f"⏰ Timer {timer['id']} terminato")
+        for notify in (lambda timer: send_ws_message(timer["message"]), *self._listeners):
+            try:
+                await notify(timer)
+            except Exception as e:
+                logger.error(f"Errore nella notifica del timer {timer['id']}: {e}")
+
+    # ---------- API ----------
+    def schedule(self, seconds: float, message: str = "⏰ Il timer è terminato!") -> dict:
+        """Programma un timer (thread-safe) e lo restituisce"""
+        if self._remote is not None:
+            return self._remote.schedule(seconds, message)
+        if self._loop is None:
+            self.start()
+        timer = {
+            "id": uuid.uuid4().hex[:8],
+            "due": time.time() + seconds,
+            "seconds": seconds,
+            "message": message,
+        }
+        with self._lock:
+            self._timers[timer["id"]] = timer
+            heapq.heappush(self._heap, (timer["due"], timer["id"]))
+            self._log({"op": "add", "timer": timer})
+        self._notify()
+        return timer
+
+    def cancel(self, timer_id: str) -> bool:
+        """Annulla un timer; la voce nell'heap viene scartata quando arriva in cima"""
+        if self._remote is not None:
+            return self._remote.cancel(timer_id)
+        with self._lock:
+            if self._timers.pop(timer_id, None) is None:
+                return False
+            self._log({"op": "del", "id": timer_id})
+        self._notify()
+        return True
+
+    def list(self) -> list:
+        """Timer in sospeso, dal più vicino, con i secondi rimanenti"""
+        if self._remote is not None:
+            return self._remote.list()
+        now = time.time()
+        with self._lock:
+            timers = sorted(self._timers.values(), key=lambda t: t["due"])
+        return [{**t, "remaining": max(0.0, round(t["due"] - now, 1))} for t in timers]
+
+    # ---------- heap ----------
+    def _seconds_to_next(self):
+        with self._lock:
+            while self._heap and self._heap[0][1] not in self._timers:
+                heapq.heappop(self._heap)
+            if not self._heap:
+                return None
+            return max(0.0, self._heap[0][0] - time.time())
+
+    def _pop_due(self) -> list:
+        now = time.time()
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                _, timer_id = heapq.heappop(self._heap)
+                timer = self._timers.pop(timer_id, None)
+                if timer is not None:
+                    due.append(timer)
+            if due:
+                self._log(*({"op": "del", "id": timer["id"]} for timer in due))
+        return due
+
+    # ---------- persistenza ----------
+    def _load(self):
+        """Ripristina i timer salvati; quelli scaduti a server spento suonano subito"""
+        if self.path.exists():
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    timers = json.load(f)
+            except (json.JSONDecodeError, OSError) as e:
+                logger.warning(f"⚠️ Timer salvati non leggibili: {e}")
+                timers = []
+            self._timers = {timer["id"]: timer for timer in timers}
+
+        if self.journal_path.exists():
+            records, valid = 0, 0
+            with open(self.journal_path, "rb") as f:
+                for line in f:
+                    try:
+                        if not line.endswith(b"\n"):
+                            raise ValueError("record troncato")
+                        record = json.loads(line)
+                    except ValueError as e:
+                        # Scrittura interrotta da un crash: il resto del journal si scarta
+                        logger.warning(f"⚠️ Journal dei timer troncato dopo {records} record: {e}")
+                        break
+                    if record["op"] == "add":
+                        self._timers[record["timer"]["id"]] = record["timer"]
+                    elif record["op"] == "del":
+                        self._timers.pop(record["id"], None)
+                    records += 1
+                    valid += len(line)
+            # I record successivi vanno accodati a quelli integri
+            if valid < self.journal_path.stat().st_size:
+                with open(self.journal_path, "r+b") as f:
+                    f.truncate(valid)
+            self._journal_records = records
+
+        self._heap = [(timer["due"], timer["id"]) for timer in self._timers.values()]
+        heapq.heapify(self._heap)
+
+    def _log(self, *records: dict):
+        """Accoda record al journal (chiamare con il lock): una scrittura breve, mai l'intero file"""
+        if self._journal is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._journal = open(self.journal_path, "ab")
+        data = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+        self._journal.write(data.encode("utf-8"))
+        self._journal.flush()
+        self._journal_records += len(records)
+
+        threshold = max(COMPACT_MIN, COMPACT_RATIO * len(self._timers))
+        if self._journal_records >= threshold and not self._compacting:
+            self._compacting = True
+            threading.Thread(target=self._compact, name="timer-compaction", daemon=True).start()
+
+    def _compact(self):
+        """Scrive lo snapshot fuori dal lock e toglie dal journal i record che contiene"""
+        try:
+            with self._lock:
+                timers = list(self._timers.values())
+                offset = self._journal.tell()
+            tmp = self.path.with_suffix(".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(timers, f, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+
+            with self._lock:
+                self._journal.close()
+                with open(self.journal_path, "rb") as f:
+                    f.seek(offset)
+                    tail = f.read()
+                journal_tmp = self.journal_path.with_suffix(".log.tmp")
+                with open(journal_tmp, "wb") as f:
+                    f.write(tail)
+                os.replace(journal_tmp, self.journal_path)
+                self._journal = open(self.journal_path, "ab")
+                self._journal_records = tail.count(b"\n")
+        except Exception as e:
+            logger.error(f"Errore nella compattazione dei timer: {e}")
+        finally:
+            with self._lock:
+                self._compacting = False
+
+# Istanza condivisa da comandi ed endpoint
+scheduler = TimerScheduler()
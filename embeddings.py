@@ -0,0 +1,121 @@
+# embeddings.py
+
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+from metrics import metrics
+
+# Configurazione logging
+logger = logging.getLogger(__name__)
+
+MODEL_NAME  = "all-MiniLM-L6-v2"
+DEVICE      = None   # None = scelta automatica (cuda se disponibile, altrimenti cpu)
+NUM_THREADS = None   # None = default di torch
+CACHE_SIZE  = 1024   # testi normalizzati di cui si tiene l'embedding
+
+# Unica istanza del modello condivisa da memoria semantica e registry dei comandi
+_model = None
+_lock = threading.Lock()
+
+# Cache LRU {testo normalizzato: embedding}
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+def configure(model_name: str = None, device: str = None, num_threads: int = None):
+    """Imposta modello, device e thread prima del primo caricamento"""
+    global MODEL_NAME, DEVICE, NUM_THREADS
+    if _model is not None:
+        logger.warning("⚠️ Modello embeddings già caricato: la configurazione vale dal prossimo riavvio")
+    if model_name is not None:
+        MODEL_NAME = model_name
+    if device is not None:
+        DEVICE = device
+    if num_threads is not None:
+        NUM_THREADS = num_threads
+
+def get_model():
+    """Carica il modello sentence transformer una sola volta (lazy loading, thread-safe)"""
+    global _model
+    if _model is None:
+        with _lock:
+            if _model is None:
+                try:
+                    # Import qui: sentence_transformers/torch richiedono secondi per l'import
+                    from sentence_transformers import SentenceTransformer
+                    if NUM_THREADS:
+                        import torch
+                        torch.set_num_threads(NUM_THREADS)
+                    _model = SentenceTransformer(MODEL_NAME, device=DEVICE)
+                    logger.info(f"✅ Modello embeddings '{MODEL_NAME}' caricato")
+                except Exception as e:
+                    logger.error(f"❌ Errore caricamento modello embeddings: {e}")
+                    raise
+    return _model
+
+def normalize(text: str) -> str:
+    """Normalizza in minuscolo + unicode NFKC, rimuove spazi extra."""
+    return unicodedata.normalize("NFKC", text.lower().strip())
+
+def is_loaded() -> bool:
+    """Indica se il modello è già in memoria"""
+    return _model is not None
+
+def encode(texts, **kwargs):
+    """Calcola gli embeddings con il modello condiviso"""
+    return get_model().encode(texts, **kwargs)
+
+def embed(text: str):
+    """
+    Embedding di un singolo testo, calcolato una sola volta per testo normalizzato.
+    Dispatcher, ricerca e salvataggio in memoria dello stesso messaggio riusano lo stesso vettore.
+    """
+    return embed_many([text])[0]
+
+def embed_many(texts) -> np.ndarray:
+    """
+    Embeddings (n, dim) di più testi: quelli non in cache vengono calcolati
+    con un'unica chiamata batch al modello.
+    """
+    norms = [normalize(text) for text in texts]
+    found = {}
+    with _cache_lock:
+        for text_norm in norms:
+            if text_norm in _cache:
+                _cache.move_to_end(text_norm)
+                found[text_norm] = _cache[text_norm]
+
+    missing = list(dict.fromkeys(t for t in norms if t not in found))
+    metrics.inc("embedding_cache", len(norms) - len(missing), result="hit")
+    if missing:
+        metrics.inc("embedding_cache", len(missing), result="miss")
+        with metrics.timer("embedding"):
+            vectors = np.asarray(encode(missing), dtype="float32")
+        with _cache_lock:
+            for text_norm, emb in zip(missing, vectors):
+                emb.flags.writeable = False  # condiviso tra chiamanti: sola lettura
+                _cache[text_norm] = found[text_norm] = emb
+            while len(_cache) > CACHE_SIZE:
+                _cache.popitem(last=False)
+
+    return np.stack([found[text_norm] for text_norm in norms]) if norms else np.empty((0, 0), dtype="float32")
+
+def clear_cache():
+    """Svuota la cache degli embeddings"""
+    with _cache_lock:
+        _cache.clear()
+
+def warm_up_in_background() -> threading.Thread:
+    """Carica il modello in un thread separato, senza bloccare l'avvio"""
+    def _warm_up():
+        try:
+            get_model()
+        except Exception:
+            pass  # già loggato in get_model, riproverà al primo utilizzo
+
+    thread = threading.Thread(target=_warm_up, name="embeddings-warmup", daemon=True)
+    thread.start()
+    return thread
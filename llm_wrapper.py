@@ -1,18 +1,449 @@
+import asyncio
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import metrics
+from single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+OLLAMA_URL = "http://localhost:11434"
+
+# Modelli precaricati e relativo keep_alive di Ollama (quanto restano in memoria da inattivi;
+# -1 = sempre). Il primo è il modello di default.
+DEFAULT_MODEL = "mistral"
+MODELS = {
+    DEFAULT_MODEL: "30m",
+}
+KEEP_WARM_INTERVAL = 300.0   # secondi tra due ping di mantenimento (minore del keep_alive)
+
+# Contesto KV di Ollama riusato tra i turni di una conversazione
+MAX_SESSIONS       = 256    # conversazioni di cui si tiene il contesto (LRU)
+SESSION_IDLE_TTL   = 1800   # secondi di inattività dopo cui il contesto viene scartato
+MAX_CONTEXT_TOKENS = 8192   # oltre, la conversazione riparte da zero (il modello la troncherebbe comunque)
+
+# Timeout (secondi): la connessione deve essere rapida, la generazione può durare a lungo
+CONNECT_TIMEOUT = 5.0
+READ_TIMEOUT    = 120.0
+
+# Limiti di concorrenza verso Ollama
+MAX_CONNECTIONS = 10   # connessioni keep-alive nel pool
+MAX_IN_FLIGHT   = 4    # generazioni contemporanee
+MAX_WAITING     = 32   # richieste in coda oltre le quali si rifiuta
+
+class OllamaBusyError(RuntimeError):
+    """Sollevata quando la coda verso Ollama è piena"""
+
+class OllamaClient:
+    """
+    Client asincrono per l'API di Ollama con pool di connessioni persistente.
+    Con max_in_flight=None non limita le generazioni: lo fa già chi lo usa (l'ammissione dell'API).
+    """
+
+    def __init__(self, base_url: str = OLLAMA_URL,
+                 connect_timeout: float = CONNECT_TIMEOUT,
+                 read_timeout: float = READ_TIMEOUT,
+                 max_connections: int = MAX_CONNECTIONS,
+                 max_in_flight: int = MAX_IN_FLIGHT,
+                 max_waiting: int = MAX_WAITING):
+        self.base_url    = base_url
+        self.timeout     = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.limits      = httpx.Limits(max_connections=max_connections,
+                                        max_keepalive_connections=max_connections)
+        self.max_waiting = max_waiting
+        self._semaphore  = asyncio.Semaphore(max_in_flight) if max_in_flight else None
+        self._waiting    = 0
+        self._client     = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """Crea il client HTTP al primo utilizzo (serve un event loop attivo)"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(base_url=self.base_url, timeout=self.timeout, limits=self.limits)
+        return self._client
+
+    @asynccontextmanager
+    async def _slot(self):
+        """Attende un posto libero tra le generazioni in corso, con coda limitata"""
+        if self._semaphore is None:
+            yield
+            return
+        if self._semaphore.locked() and self._waiting >= self.max_waiting:
+            raise OllamaBusyError(f"Troppe richieste in coda verso Ollama ({self._waiting})")
+
+        self._waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._waiting -= 1
+
+        try:
+            yield
+        finally:
+            self._semaphore.release()
+
+    @property
+    def waiting(self) -> int:
+        """Numero di richieste in attesa di uno slot"""
+        return self._waiting
+
+    async def generate(self, payload: dict) -> httpx.Response:
+        """Chiamata non in streaming a /api/generate"""
+        async with self._slot():
+            return await self._get_client().post("/api/generate", json={**payload, "stream": False})
+
+    async def stream_generate(self, payload: dict):
+        """Chiamata in streaming a /api/generate, restituisce i chunk NDJSON decodificati"""
+        async with self._slot():
+            async with self._get_client().stream("POST", "/api/generate", json={**payload, "stream": True}) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    yield {"error": response.status_code, "done": True}
+                    return
+                async for line in response.aiter_lines():
+                    if line:
+                        yield json.loads(line)
+
+    async def load(self, model: str, keep_alive) -> bool:
+        """Carica il modello in memoria senza generare (fuori dai limiti: non occupa slot)"""
+        response = await self._get_client().post("/api/generate", json={"model": model, "keep_alive": keep_alive})
+        return response.status_code == 200
+
+    async def aclose(self):
+        """Chiude il pool di connessioni"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+class SessionContexts:
+    """
+    Contesto di generazione restituito da Ollama (i token già valutati) per conversazione e modello:
+    rimandandolo al turno successivo il modello non rielabora da capo la conversazione.
+    LRU limitata, con scadenza per inattività.
+    """
+
+    def __init__(self, max_sessions: int = MAX_SESSIONS, idle_ttl: float = SESSION_IDLE_TTL,
+                 max_tokens: int = MAX_CONTEXT_TOKENS):
+        self.max_sessions = max_sessions
+        self.idle_ttl     = idle_ttl
+        self.max_tokens   = max_tokens
+        self.enabled      = True
+        self._entries     = OrderedDict()   # {(sessione, modello): (ultimo uso, contesto)}
+        self._lock        = threading.Lock()
+
+    def disable(self):
+        """
+        Smette di riusare i contesti e dimentica quelli salvati: con più worker i turni di una
+        sessione si dividono tra processi, e il contesto di uno non contiene quelli serviti dagli altri
+        """
+        with self._lock:
+            if self.enabled:
+                logger.info("🔀 Più worker attivi: contesto delle conversazioni non riusato tra i turni")
+            self.enabled = False
+            self._entries.clear()
+
+    def get(self, session: str, model: str):
+        """Contesto salvato della conversazione, o None"""
+        if session is None or not self.enabled:
+            return None
+        key = (session, model)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[0] > self.idle_ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, session: str, model: str, context):
+        """Salva il contesto dopo un turno riuscito (troppo lungo = si riparte da zero)"""
+        if session is None or not context:
+            return
+        key = (session, model)
+        with self._lock:
+            if not self.enabled:
+                return
+            if len(context) > self.max_tokens:
+                self._entries.pop(key, None)
+                return
+            self._entries[key] = (time.monotonic(), context)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_sessions:
+                self._entries.popitem(last=False)
+
+    def discard(self, session: str, model: str = None):
+        """Dimentica il contesto della conversazione (per un modello o per tutti)"""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == session and model in (None, key[1])]:
+                del self._entries[key]
+
+    def __len__(self):
+        return len(self._entries)
 
 class LocalLLM:
-    def __init__(self, model="mistral"):
+    def __init__(self, model=DEFAULT_MODEL, client: OllamaClient = None, cache=None, models: dict = None):
         self.model = model
-        self.url = "http://localhost:11434/api/generate"
-
-    def respond(self, prompt: str) -> str:
-        payload = {
-            "model": self.model,
-            "prompt": prompt,
-            "stream": False
-        }
-        response = requests.post(self.url, json=payload)
-        if response.status_code == 200:
-            return response.json().get("response", "").strip()
-        else:
-            return f"Errore nella generazione: {response.status_code}"
+        # Modelli selezionabili per richiesta: {nome: keep_alive}
+        self.models = dict(models or MODELS)
+        self.models.setdefault(model, MODELS.get(model, MODELS[DEFAULT_MODEL]))
+        self.cache = cache   # ResponseCache opzionale davanti alle generazioni senza contesto di conversazione
+        self.contexts = SessionContexts()
+        self._flights = SingleFlight("llm")   # generazioni identiche in corso condivise (solo async)
+        self.url = f"{OLLAMA_URL}/api/generate"
+        self.timeout = (CONNECT_TIMEOUT, READ_TIMEOUT)
+        self.client = client or OllamaClient()
+
+        # Sessione sincrona (CLI) con connessioni keep-alive
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=MAX_CONNECTIONS))
+
+    def resolve_model(self, model: str = None) -> str:
+        """Modello da usare per una richiesta; ValueError se non è tra quelli configurati"""
+        model = model or self.model
+        if model not in self.models:
+            raise ValueError(f"Modello non disponibile: {model!r} (disponibili: {', '.join(self.models)})")
+        return model
+
+    def _payload(self, model: str, prompt: str, kv=None) -> dict:
+        payload = {"model": model, "prompt": prompt, "keep_alive": self.models[model]}
+        if kv:
+            payload["context"] = kv
+        return payload
+
+    def _contexts_to_try(self, session: str, model: str) -> list:
+        """Contesto salvato della conversazione e, se c'è, None come ripiego nel caso sia stato invalidato"""
+        kv = self.contexts.get(session, model)
+        return [kv, None] if kv else [None]
+
+    def _invalidate(self, session: str, model: str, error):
+        logger.warning(f"Contesto della conversazione {session!r} rifiutato ({error}): si riparte da zero")
+        self.contexts.discard(session, model)
+
+    def _finish(self, session: str, model: str, kv, prompt: str, text: str, embedding, context: str, data: dict):
+        """Dopo un turno riuscito: contesto KV per il turno successivo e cache (solo senza conversazione)"""
+        self.contexts.put(session, model, data.get("context"))
+        if kv is None:
+            self._store(model, prompt, text, embedding, context)
+
+    def _cached(self, model: str, prompt: str, embedding, context: str):
+        """Risposta già in cache per questo prompt, se presente"""
+        if self.cache is None:
+            return None
+        return self.cache.get(model, prompt, embedding=embedding, context=context)
+
+    def _store(self, model: str, prompt: str, response: str, embedding, context: str):
+        """Memorizza una risposta generata con successo"""
+        if self.cache is not None and response:
+            self.cache.put(model, prompt, response, embedding=embedding, context=context)
+
+    # ---------- warm-up ----------
+    def warm_up(self, models=None) -> dict:
+        """Carica i modelli in Ollama (sincrono, per la CLI): {modello: caricato}"""
+        loaded = {}
+        for model in models or self.models:
+            try:
+                response = self.session.post(self.url, json={"model": model, "keep_alive": self.models[model]},
+                                             timeout=self.timeout)
+                loaded[model] = response.status_code == 200
+            except requests.RequestException as e:
+                logger.warning(f"Warm-up di {model} non riuscito: {e}")
+                loaded[model] = False
+        return loaded
+
+    async def awarm_up(self, models=None) -> dict:
+        """Carica i modelli in Ollama in parallelo: {modello: caricato}"""
+        models = list(models or self.models)
+        results = await asyncio.gather(*(self.client.load(model, self.models[model]) for model in models),
+                                       return_exceptions=True)
+        loaded = {}
+        for model, result in zip(models, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Warm-up di {model} non riuscito: {result}")
+            loaded[model] = result is True
+        return loaded
+
+    async def keep_warm(self, wait_ready=None, interval: float = KEEP_WARM_INTERVAL):
+        """
+        Task di mantenimento: carica i modelli appena Ollama è pronto e li ripinga
+        ogni `interval` secondi, così non vengono scaricati nei periodi di inattività.
+        wait_ready è una coroutine function opzionale che restituisce True quando Ollama risponde.
+        """
+        while True:
+            if wait_ready is not None and not await wait_ready():
+                await asyncio.sleep(1.0)
+                continue
+            start = time.perf_counter()
+            loaded = await self.awarm_up()
+            logger.info(f"🔥 Modelli caldi: {loaded} ({time.perf_counter() - start:.1f}s)")
+            await asyncio.sleep(interval)
+
+    def keep_warm_in_background(self, wait_ready=None, interval: float = KEEP_WARM_INTERVAL) -> threading.Thread:
+        """Come keep_warm, in un thread separato (CLI); wait_ready è una funzione bloccante"""
+        def _keep_warm():
+            while True:
+                if wait_ready is not None and not wait_ready():
+                    time.sleep(1.0)
+                    continue
+                logger.info(f"🔥 Modelli caldi: {self.warm_up()}")
+                time.sleep(interval)
+
+        thread = threading.Thread(target=_keep_warm, name="llm-keep-warm", daemon=True)
+        thread.start()
+        return thread
+
+    def respond(self, prompt: str, embedding=None, context: str = "", model: str = None,
+                session: str = None) -> str:
+        """
+        Risposta completa dell'LLM (model: uno dei modelli configurati, default self.model).
+        embedding (della domanda) e context servono solo per gli hit semantici della cache;
+        session identifica la conversazione di cui riusare il contesto KV tra un turno e l'altro.
+        """
+        model = self.resolve_model(model)
+        for kv in self._contexts_to_try(session, model):
+            if kv is None:
+                cached = self._cached(model, prompt, embedding, context)
+                if cached is not None:
+                    return cached
+
+            payload = {**self._payload(model, prompt, kv), "stream": False}
+            with metrics.timer("llm_generate"):
+                response = self.session.post(self.url, json=payload, timeout=self.timeout)
+            if response.status_code == 200:
+                data = response.json()
+                text = data.get("response", "").strip()
+                self._finish(session, model, kv, prompt, text, embedding, context, data)
+                return text
+            if kv is not None:
+                self._invalidate(session, model, response.status_code)
+        return f"Errore nella generazione: {response.status_code}"
+
+    def stream(self, prompt: str, embedding=None, context: str = "", model: str = None, session: str = None):
+        """Genera la risposta token per token leggendo lo stream NDJSON di Ollama"""
+        model = self.resolve_model(model)
+        for kv in self._contexts_to_try(session, model):
+            if kv is None:
+                cached = self._cached(model, prompt, embedding, context)
+                if cached is not None:
+                    yield cached
+                    return
+
+            payload = {**self._payload(model, prompt, kv), "stream": True}
+            start = time.perf_counter()
+            with self.session.post(self.url, json=payload, stream=True, timeout=self.timeout) as response:
+                if response.status_code != 200:
+                    if kv is not None:
+                        self._invalidate(session, model, response.status_code)
+                        continue
+                    yield f"Errore nella generazione: {response.status_code}"
+                    return
+
+                tokens = []
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    token = chunk.get("response", "")
+                    # Come in respond, niente spazi iniziali nella risposta
+                    if not tokens:
+                        token = token.lstrip()
+                    if token:
+                        if not tokens:
+                            metrics.record("llm_first_token", time.perf_counter() - start)
+                        tokens.append(token)
+                        yield token
+                    if chunk.get("done"):
+                        metrics.record("llm_stream", time.perf_counter() - start)
+                        self._finish(session, model, kv, prompt, "".join(tokens).strip(), embedding, context, chunk)
+                        break
+                return
+
+    async def arespond(self, prompt: str, embedding=None, context: str = "", model: str = None,
+                       session: str = None) -> str:
+        """Versione asincrona di respond, passa dal client con pool e limiti"""
+        model = self.resolve_model(model)
+        for kv in self._contexts_to_try(session, model):
+            if kv is None:
+                cached = self._cached(model, prompt, embedding, context)
+                if cached is not None:
+                    return cached
+
+            status, data = await self._generate(model, prompt, kv)
+            if status == 200:
+                text = data.get("response", "").strip()
+                self._finish(session, model, kv, prompt, text, embedding, context, data)
+                return text
+            if kv is not None:
+                self._invalidate(session, model, status)
+        return f"Errore nella generazione: {status}"
+
+    async def astream(self, prompt: str, embedding=None, context: str = "", model: str = None,
+                      session: str = None):
+        """Versione asincrona di stream"""
+        model = self.resolve_model(model)
+        for kv in self._contexts_to_try(session, model):
+            if kv is None:
+                cached = self._cached(model, prompt, embedding, context)
+                if cached is not None:
+                    yield cached
+                    return
+
+            tokens = []
+            start = time.perf_counter()
+            async for chunk in self._stream_generate(model, prompt, kv):
+                if "error" in chunk:
+                    break
+                token = chunk.get("response", "")
+                if not tokens:
+                    token = token.lstrip()
+                if token:
+                    if not tokens:
+                        metrics.record("llm_first_token", time.perf_counter() - start)
+                    tokens.append(token)
+                    yield token
+                if chunk.get("done"):
+                    metrics.record("llm_stream", time.perf_counter() - start)
+                    self._finish(session, model, kv, prompt, "".join(tokens).strip(), embedding, context, chunk)
+                    return
+            else:
+                return
+
+            # Errore prima del primo token: con un contesto salvato si riprova senza
+            if kv is not None and not tokens:
+                self._invalidate(session, model, chunk["error"])
+                continue
+            yield f"Errore nella generazione: {chunk['error']}"
+            return
+
+    async def _generate(self, model: str, prompt: str, kv):
+        """
+        Una chiamata a /api/generate: (status, risposta JSON). Senza contesto KV la risposta
+        dipende solo da modello e prompt, quindi le richieste identiche in corso ne fanno una sola.
+        """
+        async def call():
+            with metrics.timer("llm_generate"):
+                response = await self.client.generate(self._payload(model, prompt, kv))
+            return response.status_code, (response.json() if response.status_code == 200 else {})
+
+        if kv:
+            return await call()
+        return await self._flights.do((model, prompt), call)
+
+    def _stream_generate(self, model: str, prompt: str, kv):
+        """Chunk di /api/generate in streaming, condivisi tra richieste identiche come in _generate"""
+        if kv:
+            return self.client.stream_generate(self._payload(model, prompt, kv))
+        return self._flights.stream((model, prompt), lambda: self.client.stream_generate(self._payload(model, prompt)))
+
+    async def aclose(self):
+        """Rilascia le connessioni aperte"""
+        await self.client.aclose()
+        self.session.close()
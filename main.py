@@ -1,70 +1,49 @@
 # main.py
 
-import subprocess
-import requests
-import time
 import sys
 import signal
 import logging
+import embeddings
 from llm_wrapper import LocalLLM
-from memory.memory import load_memory, save_memory
+from ollama_supervisor import supervisor, STARTUP_TIMEOUT
+from response_cache import ResponseCache
+from memory.memory import HistoryStore
 from agent import dispatch, get_available_commands
 from memory.semantic_memory import SemanticMemory
 from commands.registry import dispatch_semantic_hybrid
+from commands.scheduler import scheduler
 
 # Configurazione logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Conversazione della CLI: l'LLM ne riusa il contesto tra un turno e l'altro
+CLI_SESSION = "cli"
+
 # Variabili globali per gestione risorse
-ollama_process = None
 sem_mem = None
 llm = None
-memory = None
+history = None
 
 def signal_handler(signum, frame):
     """Gestisce l'interruzione con Ctrl+C"""
     print("\n🤖 Interruzione rilevata. Spegnimento in corso...")
     cleanup_and_exit()
 
-def is_ollama_running():
-    """Verifica se Ollama è in esecuzione"""
-    try:
-        res = requests.get("http://localhost:11434", timeout=5)
-        return res.status_code == 200
-    except Exception as e:
-        logger.debug(f"Ollama non raggiungibile: {e}")
-        return False
-
-def start_ollama():
-    """Avvia Ollama in background"""
-    global ollama_process
-    try:
-        logger.info("⚙️ Avvio Ollama in background...")
-        ollama_process = subprocess.Popen(
-            ["ollama", "serve"], 
-            stdout=subprocess.DEVNULL, 
-            stderr=subprocess.DEVNULL
-        )
-        return True
-    except Exception as e:
-        logger.error(f"Errore nell'avvio di Ollama: {e}")
-        return False
-
 def cleanup_and_exit():
     """Pulizia risorse e uscita"""
-    global ollama_process
+    # I timer in sospeso restano salvati per il prossimo avvio
+    scheduler.stop()
     
-    if ollama_process:
-        logger.info("🧹 Terminazione Ollama...")
-        ollama_process.terminate()
+    # Compatta la memoria semantica (il WAL garantisce comunque il recupero)
+    if sem_mem:
         try:
-            ollama_process.wait(timeout=5)
-            logger.info("✅ Ollama terminato correttamente")
-        except subprocess.TimeoutExpired:
-            logger.warning("⚠️ Ollama non risponde, forzando terminazione...")
-            ollama_process.kill()
-            logger.info("✅ Ollama terminato forzatamente")
+            sem_mem.close()
+        except Exception as e:
+            logger.error(f"Errore nel salvataggio della memoria semantica: {e}")
+    
+    # Termina Ollama solo se è stato avviato da noi
+    supervisor.stop()
     
     logger.info("👋 Ciao!")
     sys.exit(0)
@@ -88,8 +67,8 @@ def process_correction(command: str) -> bool:
     print("✅ Correzione registrata.")
     return True
 
-def process_command(command: str) -> str:
-    """Processa un comando e restituisce la risposta"""
+def resolve_command(command: str):
+    """Prova i dispatcher dei comandi, restituisce None se serve l'LLM"""
     # Prova dispatcher semantico ibrido
     response = dispatch_semantic_hybrid(command)
     if response:
@@ -100,11 +79,44 @@ def process_command(command: str) -> str:
     if response:
         return response
     
-    # Fallback su LLM con contesto
-    context = sem_mem.search(command)
-    prompt = (f"Contesto precedente: {context}\nDomanda: {command}" 
-             if context and context != command else command)
-    return llm.respond(prompt)
+    return None
+
+def build_prompt(command: str):
+    """
+    Costruisce il prompt per l'LLM con il contesto della memoria semantica.
+    Restituisce (prompt, contesto, embedding della domanda) per la cache delle risposte.
+    """
+    emb = embeddings.embed(command)
+    context = sem_mem.context(command, emb=emb)
+    prompt = (f"Contesto precedente:\n{context}\nDomanda: {command}" 
+              if context and context != command else command)
+    return prompt, context, emb
+
+def process_command(command: str) -> str:
+    """Processa un comando e restituisce la risposta"""
+    response = resolve_command(command)
+    if response is not None:
+        return response
+    
+    # Fallback su LLM con contesto (attende Ollama se si sta ancora avviando)
+    supervisor.require_ready_sync(STARTUP_TIMEOUT)
+    prompt, context, emb = build_prompt(command)
+    return llm.respond(prompt, embedding=emb, context=context, session=CLI_SESSION)
+
+def stream_command(command: str):
+    """Come process_command, ma restituisce la risposta dell'LLM token per token"""
+    response = resolve_command(command)
+    if response is not None:
+        yield response
+        return
+    
+    supervisor.require_ready_sync(STARTUP_TIMEOUT)
+    prompt, context, emb = build_prompt(command)
+    yield from llm.stream(prompt, embedding=emb, context=context, session=CLI_SESSION)
+
+async def announce_timer(timer: dict):
+    """Stampa il messaggio di un timer scaduto"""
+    print(f"\n{timer['message']}")
 
 def show_welcome():
     """Mostra messaggio di benvenuto"""
@@ -127,36 +139,28 @@ def show_help():
     print("-" * 50)
 
 def main():
-    global ollama_process, sem_mem, llm, memory
+    global sem_mem, llm, history
     
     # Registra handler per Ctrl+C
     signal.signal(signal.SIGINT, signal_handler)
     
-    # Inizializza Ollama
-    if not is_ollama_running():
-        if not start_ollama():
-            logger.error("❌ Impossibile avviare Ollama")
-            sys.exit(1)
-        
-        # Attendi che Ollama sia pronto
-        for attempt in range(15):
-            if is_ollama_running():
-                logger.info("✅ Ollama avviato con successo")
-                break
-            time.sleep(1)
-            logger.info(f"⏳ Tentativo {attempt + 1}/15 - Attendo Ollama...")
-        else:
-            logger.error("❌ Ollama non si è avviato entro il timeout")
-            cleanup_and_exit()
-    else:
-        logger.info("✅ Ollama è già attivo")
+    # Carica il modello di embeddings mentre si attende Ollama
+    embeddings.warm_up_in_background()
+    
+    # Ollama si avvia in background: i comandi locali funzionano subito
+    supervisor.start()
+    
+    # I timer che suonano si annunciano nel terminale
+    scheduler.add_listener(announce_timer)
     
     # Inizializza componenti
     try:
         sem_mem = SemanticMemory()
-        llm = LocalLLM()
-        memory = load_memory()
+        llm = LocalLLM(cache=ResponseCache())
+        history = HistoryStore()
         logger.info("✅ Componenti inizializzati")
+        # Carica il modello appena Ollama è pronto, così la prima domanda non attende il caricamento
+        llm.keep_warm_in_background(wait_ready=lambda: supervisor.wait_ready_sync(STARTUP_TIMEOUT))
     except Exception as e:
         logger.error(f"❌ Errore nell'inizializzazione: {e}")
         cleanup_and_exit()
@@ -183,14 +187,18 @@ def main():
                 if process_correction(command):
                     continue
                 
-                # Processa comando normale
-                response = process_command(command)
-                print("AI:", response)
+                # Processa comando normale, stampando i token appena arrivano
+                print("AI:", end=" ", flush=True)
+                chunks = []
+                for chunk in stream_command(command):
+                    chunks.append(chunk)
+                    print(chunk, end="", flush=True)
+                print()
+                response = "".join(chunks)
                 
                 # Salva in memoria
                 sem_mem.add(command)
-                memory["history"].append({"user": command, "ai": response})
-                save_memory(memory)
+                history.append({"user": command, "ai": response})
                 
             except EOFError:
                 print("\n🤖 Input terminato")
@@ -1,18 +1,98 @@
+import os
 import json
+import threading
 from pathlib import Path
 
-MEMORY_PATH = Path("memory/memory.json")
+MEMORY_PATH  = Path("memory/memory.json")
+HISTORY_PATH = Path("memory/history.jsonl")
 
-def load_memory():
-    if not MEMORY_PATH.exists() or MEMORY_PATH.stat().st_size == 0:
+def load_memory(path: Path = MEMORY_PATH):
+    path = Path(path)
+    if not path.exists() or path.stat().st_size == 0:
         return {"history": []}
     try:
-        with open(MEMORY_PATH, "r") as f:
+        with open(path, "r") as f:
             return json.load(f)
     except json.JSONDecodeError:
         # File corrotto o vuoto
         return {"history": []}
 
-def save_memory(memory):
-    with open(MEMORY_PATH, "w") as f:
-        json.dump(memory, f, indent=2)
+class HistoryStore:
+    """
+    Cronologia append-only in formato JSONL: una riga per interazione.
+    Aggiungere costa O(1) e le ultime N voci si leggono dalla fine del file.
+    """
+
+    BLOCK_SIZE = 8192
+
+    def __init__(self, path: Path = HISTORY_PATH, legacy_path: Path = MEMORY_PATH, read_only: bool = False):
+        self.path  = Path(path)
+        self._lock = threading.Lock()
+        if read_only:
+            return   # file e migrazione sono compito di chi scrive
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if not self.path.exists():
+            self._migrate_legacy(legacy_path)
+
+    def _migrate_legacy(self, legacy_path: Path):
+        """Importa una sola volta la cronologia dal vecchio memory.json (se indicato)"""
+        history = load_memory(legacy_path).get("history", []) if legacy_path else []
+        tmp = self.path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            for entry in history:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        os.replace(tmp, self.path)
+
+    def append(self, entry: dict):
+        """Aggiunge un'interazione in coda"""
+        self.extend([entry])
+
+    def extend(self, entries):
+        """Aggiunge più interazioni con una sola scrittura"""
+        data = "".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries)
+        if not data:
+            return
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(data)
+
+    def tail(self, limit: int) -> list:
+        """Ultime `limit` interazioni, leggendo a blocchi dalla fine del file"""
+        if limit <= 0 or not self.path.exists():
+            return []
+
+        with open(self.path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            position = f.tell()
+            data = b""
+            # Una riga in più per scartare un'eventuale riga iniziale spezzata
+            while position > 0 and data.count(b"\n") <= limit:
+                size = min(self.BLOCK_SIZE, position)
+                position -= size
+                f.seek(position)
+                data = f.read(size) + data
+
+        lines = data.splitlines()
+        if position > 0:
+            lines = lines[1:]
+        return _decode(lines)[-limit:]
+
+    def __iter__(self):
+        """Scorre tutta la cronologia senza caricarla in memoria"""
+        if not self.path.exists():
+            return
+        with open(self.path, "rb") as f:
+            for line in f:
+                yield from _decode([line])
+
+def _decode(lines) -> list:
+    """Decodifica le righe JSONL, ignorando quelle vuote o scritte a metà"""
+    entries = []
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            entries.append(json.loads(line))
+        except json.JSONDecodeError:
+            continue
+    return entries
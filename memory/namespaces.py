@@ -0,0 +1,161 @@
+import os
+import re
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from memory.memory import HistoryStore, HISTORY_PATH, MEMORY_PATH
+from memory.semantic_memory import SemanticMemory, SemanticMemoryReader, STORE_DIR
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_NAMESPACE = "default"
+SESSIONS_DIR      = "memory/sessions"
+MAX_ACTIVE        = 32      # namespace tenuti in memoria; i meno usati vengono scaricati
+
+SESSION_ID_PATTERN = r"^[A-Za-z0-9_-]{1,64}$"
+_session_id_re = re.compile(SESSION_ID_PATTERN)
+
+class Namespace:
+    """
+    Memoria di una sessione/utente: indice semantico e cronologia propri.
+    In sola lettura (worker che non scrivono) l'indice è aperto in memory map.
+    """
+
+    def __init__(self, name: str, index_type: str = None, read_only: bool = False):
+        self.name = name
+        memory_class = SemanticMemoryReader if read_only else SemanticMemory
+        if name == DEFAULT_NAMESPACE:
+            # Il namespace di default usa i file storici, così i dati esistenti restano validi
+            self.sem_mem = memory_class(index_type=index_type, store_dir=STORE_DIR)
+            self.history = HistoryStore(HISTORY_PATH, legacy_path=MEMORY_PATH, read_only=read_only)
+        else:
+            base = os.path.join(SESSIONS_DIR, name)
+            self.sem_mem = memory_class(index_type=index_type, store_dir=os.path.join(base, "memory_store"))
+            self.history = HistoryStore(os.path.join(base, "history.jsonl"), legacy_path=None, read_only=read_only)
+
+    def close(self):
+        self.sem_mem.close()
+
+class NamespaceManager:
+    """
+    Namespace caricati al primo utilizzo e scaricati in ordine LRU oltre max_active:
+    ogni ricerca tocca solo i vettori della sessione e la memoria cresce con gli utenti attivi.
+
+    on_evict riceve il namespace da scaricare; chi gestisce le scritture deve poi chiamare
+    finish_close(ns) quando non ci sono più scritture in sospeso (di default si chiude subito).
+    Con read_only i namespace si aprono in sola lettura e le scritture vanno inoltrate allo scrittore.
+    """
+
+    def __init__(self, max_active: int = MAX_ACTIVE, index_type: str = None, on_evict=None,
+                 read_only: bool = False):
+        self.max_active = max_active
+        self.index_type = index_type
+        self.read_only  = read_only
+        self.on_evict   = on_evict or self.finish_close
+        self._active    = OrderedDict()   # {nome: Namespace}
+        self._closing   = {}              # scaricati, in attesa di chiusura
+        self._loading   = {}              # {nome: Future} dei namespace in caricamento
+        self._finishing = {}              # {nome: Future} dei namespace in chiusura (salvataggio)
+        self._lock      = threading.Lock()
+
+    @staticmethod
+    def validate(session_id: str) -> str:
+        """Restituisce l'ID di sessione (default se vuoto) o solleva ValueError"""
+        session_id = session_id or DEFAULT_NAMESPACE
+        if not _session_id_re.match(session_id):
+            raise ValueError(f"ID di sessione non valido: {session_id!r}")
+        return session_id
+
+    def get(self, session_id: str = None) -> Namespace:
+        """
+        Namespace della sessione, caricato se necessario. Il caricamento (indice, WAL, cronologia)
+        avviene fuori dal lock: le altre sessioni non aspettano, chi chiede la stessa attende quello in corso.
+        """
+        name = self.validate(session_id)
+        while True:
+            with self._lock:
+                ns = self._active.get(name)
+                if ns is not None:
+                    self._active.move_to_end(name)
+                    return ns
+
+                # Un namespace appena scaricato ma non ancora chiuso viene ripreso così com'è
+                ns = self._closing.pop(name, None)
+                finishing = None if ns is not None else self._finishing.get(name)
+                if ns is not None:
+                    evicted = self._activate(ns)
+                elif finishing is None:
+                    loading = self._loading.get(name)
+                    if loading is not None:
+                        owner = False
+                    else:
+                        loading = self._loading[name] = Future()
+                        owner = True
+            # Se si sta chiudendo, lo si ricarica solo dopo il salvataggio
+            if finishing is None:
+                break
+            finishing.result()
+
+        if ns is None:
+            if not owner:
+                return loading.result()
+            try:
+                ns = Namespace(name, self.index_type, self.read_only)
+            except BaseException as e:
+                with self._lock:
+                    del self._loading[name]
+                loading.set_exception(e)
+                raise
+            logger.info(f"📂 Namespace '{name}' caricato")
+            with self._lock:
+                del self._loading[name]
+                evicted = self._activate(ns)
+            loading.set_result(ns)
+
+        for old in evicted:
+            logger.info(f"💤 Namespace '{old.name}' inattivo: scaricato")
+            self.on_evict(old)
+        return ns
+
+    def _activate(self, ns: Namespace) -> list:
+        """Rende attivo un namespace e restituisce quelli da scaricare oltre max_active (chiamare con il lock)"""
+        self._active[ns.name] = ns
+        evicted = []
+        while len(self._active) > self.max_active:
+            _, old = self._active.popitem(last=False)
+            self._closing[old.name] = old
+            evicted.append(old)
+        return evicted
+
+    def finish_close(self, ns: Namespace):
+        """
+        Chiude un namespace scaricato, a meno che nel frattempo non sia stato ripreso.
+        Il salvataggio avviene fuori dal lock: solo chi chiede proprio questa sessione lo attende.
+        """
+        with self._lock:
+            if self._closing.get(ns.name) is not ns:
+                return
+            del self._closing[ns.name]
+            done = self._finishing[ns.name] = Future()
+        try:
+            ns.close()
+        finally:
+            with self._lock:
+                del self._finishing[ns.name]
+            done.set_result(None)
+
+    def active(self) -> list:
+        """Nomi dei namespace in memoria, dal meno al più recente"""
+        with self._lock:
+            return list(self._active)
+
+    def close_all(self):
+        """Chiude tutti i namespace (da chiamare allo spegnimento)"""
+        with self._lock:
+            namespaces = list(self._active.values()) + list(self._closing.values())
+            self._active.clear()
+            self._closing.clear()
+        for ns in namespaces:
+            ns.close()
@@ -1,84 +1,861 @@
 import faiss
 import os
+import json
+import base64
 import pickle
+import logging
+import time
+import threading
 import numpy as np
-import unicodedata
-from sentence_transformers import SentenceTransformer
+import embeddings
+from embeddings import normalize
+from metrics import metrics
+from memory.text_store import TextStore, encode as encode_texts
 
-INDEX_PATH   = "memory/memory_store/faiss.index"
-MAPPING_PATH = "memory/memory_store/id_map.pkl"
+logger = logging.getLogger(__name__)
 
-model = SentenceTransformer("all-MiniLM-L6-v2")
+STORE_DIR    = "memory/memory_store"
+META_FILE    = "meta.json"    # snapshot corrente: scritto per ultimo, è il punto di commit
+WAL_FILE     = "wal.log"
 
-def normalize(text: str) -> str:
-    """Normalizza in minuscolo + unicode NFKC, rimuove spazi extra."""
-    return unicodedata.normalize("NFKC", text.lower().strip())
+# File di uno snapshot, per generazione: chi legge quello vecchio non vede mai file a metà
+SNAPSHOT_INDEX      = "faiss.{}.index"
+SNAPSHOT_TEXT_INDEX = "texts.{}.npy"
+SNAPSHOT_TEXT_DATA  = "texts.{}.bin"
+
+# Formato precedente (indice e dizionario in pickle), migrato al primo salvataggio
+INDEX_FILE   = "faiss.index"
+MAPPING_FILE = "id_map.pkl"
+
+INDEX_PATH   = os.path.join(STORE_DIR, INDEX_FILE)
+MAPPING_PATH = os.path.join(STORE_DIR, MAPPING_FILE)
+WAL_PATH     = os.path.join(STORE_DIR, WAL_FILE)
+
+# Apertura in sola lettura con memory map: i vettori restano nella page cache, condivisi tra processi
+MMAP_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+# Il write-ahead log si compatta in background quando i suoi record superano una frazione
+# dei vettori (e almeno COMPACT_MIN): riscrivere lo snapshot costa O(n), ma avviene ogni
+# O(n) turni, quindi il costo per turno resta costante al crescere della memoria
+COMPACT_MIN   = 200
+COMPACT_RATIO = 0.25
+
+# Tipo di indice: "flat" (esatto, ricerca O(n)), "hnsw" o "ivf" (approssimati)
+INDEX_TYPE = "flat"
+
+HNSW_M               = 32      # vicini per nodo del grafo
+HNSW_EF_CONSTRUCTION = 80
+HNSW_EF_SEARCH       = 64      # più alto = recall migliore, ricerca più lenta
+
+IVF_MIN_TRAIN      = 10_000    # sotto questa soglia l'indice IVF resta flat
+IVF_RETRAIN_GROWTH = 4         # si riaddestra quando i vettori crescono di questo fattore
+IVF_NPROBE         = 16        # liste visitate per ricerca
+
+# Recupero del contesto: similarità coseno minima, ricordi al massimo e budget di token nel prompt
+MIN_SCORE      = 0.5
+CONTEXT_TOP_K  = 5
+CONTEXT_TOKENS = 256
+
+# Eliminazioni logiche (tombstone) oltre le quali la compattazione rimuove davvero i vettori
+TOMBSTONE_MIN   = 100
+TOMBSTONE_RATIO = 0.1
+
+# Aggiunte arrivate durante una ricostruzione: si copiano nel nuovo indice fuori dal lock
+# finché ne restano al massimo SWAP_BACKLOG (o per SWAP_ROUNDS giri), poi lo scambio sotto lock
+SWAP_BACKLOG = 64
+SWAP_ROUNDS  = 4
+
+def _as_query(emb) -> np.ndarray:
+    """Porta un embedding nel formato richiesto da FAISS: matrice (1, dim) float32"""
+    return np.asarray(emb, dtype="float32").reshape(1, -1)
+
+def _normalize_rows(vectors) -> np.ndarray:
+    """Vettori (n, dim) float32 a norma unitaria: prodotto scalare = similarità coseno"""
+    vectors = np.array(vectors, dtype="float32", order="C", ndmin=2)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+def estimate_tokens(text: str) -> int:
+    """Stima grezza dei token (~4 caratteri per token)"""
+    return max(1, len(text) // 4)
+
+def pack_context(hits, max_tokens: int = CONTEXT_TOKENS) -> str:
+    """Unisce i ricordi (già ordinati per score) finché entrano nel budget di token"""
+    lines, used = [], 0
+    for text, _ in hits:
+        cost = estimate_tokens(text)
+        if used + cost > max_tokens:
+            continue   # uno successivo più corto potrebbe ancora entrare
+        lines.append(text)
+        used += cost
+    return "\n".join(lines)
+
+def _atomic_write(path: str, data: bytes):
+    """Scrive su un file temporaneo e lo sostituisce: mai un file scritto a metà"""
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def _read_meta(path: str):
+    """Descrittore dello snapshot corrente (None se non è ancora stato scritto)"""
+    try:
+        with open(path, "rb") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def _read_wal(f) -> tuple:
+    """
+    Record integri del WAL dalla posizione corrente: ([(op, id, testo, vettore)], byte letti, errore).
+    Si ferma al primo record troncato o illeggibile (scrittura interrotta o ancora in corso).
+    """
+    records, valid = [], 0
+    for line in f:
+        try:
+            if not line.endswith(b"\n"):
+                raise ValueError("record troncato")
+            rec = json.loads(line)
+            if rec["op"] == "add":
+                vec = np.frombuffer(base64.b64decode(rec["vec"]), dtype="float32")
+                records.append(("add", int(rec["id"]), rec["text"], vec))
+            elif rec["op"] == "del":
+                records.append(("del", int(rec["id"]), None, None))
+        except (ValueError, KeyError) as e:
+            return records, valid, e
+        valid += len(line)
+    return records, valid, None
+
+def _net_changes(records, snapshot_next: int) -> tuple:
+    """
+    Effetto netto dei record: aggiunte {id: (testo, vettore)} non ancora nello snapshot
+    (gli ID sono monotoni: quelli inferiori a snapshot_next ci sono già) ed eliminazioni
+    """
+    added, deleted = {}, set()
+    for op, idx, text, vec in records:
+        if op == "add":
+            if idx >= snapshot_next:
+                added[idx] = (text, vec)
+                deleted.discard(idx)
+        else:
+            added.pop(idx, None)
+            deleted.add(idx)
+    return added, deleted
 
 class SemanticMemory:
-    def __init__(self):
+    """
+    Memoria semantica su indice FAISS.
+    Ogni modifica viene accodata al write-ahead log (costo costante per turno);
+    periodicamente il log viene compattato in un nuovo snapshot (indice FAISS e TextStore).
+    Gli ID sono monotoni e mai riusati; le eliminazioni sono tombstone escluse dalle
+    ricerche e rimosse fisicamente dall'indice durante la compattazione.
+    """
+
+    def __init__(self, index_type: str = None, store_dir: str = STORE_DIR):
+        self.store_dir    = store_dir
+        self.meta_path    = os.path.join(store_dir, META_FILE)
+        self.wal_path     = os.path.join(store_dir, WAL_FILE)
+        self.index_path   = os.path.join(store_dir, INDEX_FILE)     # formato precedente
+        self.mapping_path = os.path.join(store_dir, MAPPING_FILE)   # formato precedente
+        self.generation   = 0             # generazione dell'ultimo snapshot scritto
         self.index  = None            # faiss.IndexIDMap
         self.id_map = {}              # {int: str}
         self.dim    = 384             # Dimensionalità embedding
+        self.next_id    = 0           # prossimo ID da assegnare (persistito con l'indice)
+        self.tombstones = set()       # ID eliminati ma ancora presenti nell'indice
+        self._params    = None        # parametri di ricerca che escludono i tombstone
+        self.index_type   = index_type or INDEX_TYPE
+        self._trained_on  = 0         # vettori usati per l'ultimo addestramento IVF
+        self._lock         = threading.RLock()  # protegge indice, mappa e WAL
+        self._compact_lock = threading.Lock()   # una sola compattazione alla volta
+        self._compacting   = False              # compattazione in background già avviata
+        self._pending      = None               # aggiunte durante una ricostruzione [(ids, vettori)]
+        self._wal          = None
+        self._wal_records  = 0
         self._load()
 
+    # ---------- costruzione indice ----------
+    def _build_index(self, ids=None, vecs=None):
+        """Crea un indice del tipo configurato contenente i vettori dati"""
+        n = 0 if ids is None else len(ids)
+        if n:
+            vecs = _normalize_rows(vecs)
+
+        # Prodotto scalare su vettori normalizzati: score = similarità coseno
+        if self.index_type == "hnsw":
+            base = faiss.IndexHNSWFlat(self.dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+            base.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+            base.hnsw.efSearch       = HNSW_EF_SEARCH
+        elif self.index_type == "ivf" and n >= IVF_MIN_TRAIN:
+            nlist     = int(np.sqrt(n))
+            quantizer = faiss.IndexFlatIP(self.dim)
+            base      = faiss.IndexIVFFlat(quantizer, self.dim, nlist, faiss.METRIC_INNER_PRODUCT)
+            base.train(vecs)
+            base.nprobe      = IVF_NPROBE
+            self._trained_on = n
+            logger.info(f"🧠 Indice IVF addestrato su {n} vettori ({nlist} liste)")
+        elif self.index_type in ("flat", "ivf"):
+            base = faiss.IndexFlatIP(self.dim)
+        else:
+            raise ValueError(f"Tipo di indice non supportato: {self.index_type}")
+
+        index = faiss.IndexIDMap(base)
+        if n:
+            index.add_with_ids(vecs, ids)
+        return index
+
+    def _index_kind(self, index=None) -> str:
+        """Tipo effettivo dell'indice ("flat", "hnsw" o "ivf")"""
+        base = faiss.downcast_index((index or self.index).index)
+        if isinstance(base, faiss.IndexHNSW):
+            return "hnsw"
+        if isinstance(base, faiss.IndexIVF):
+            return "ivf"
+        return "flat"
+
+    def _expected_kind(self) -> str:
+        """Tipo che l'indice dovrebbe avere con i vettori attuali"""
+        if self.index_type == "ivf" and self.index.ntotal < IVF_MIN_TRAIN:
+            return "flat"
+        return self.index_type
+
+    def _needs_rebuild(self) -> bool:
+        """True se l'indice va migrato (tipo o metrica L2 dei vecchi indici) o riaddestrato"""
+        if self.index.metric_type != faiss.METRIC_INNER_PRODUCT:
+            return True
+        kind = self._index_kind()
+        if kind != self._expected_kind():
+            return True
+        return kind == "ivf" and self.index.ntotal >= IVF_RETRAIN_GROWTH * self._trained_on
+
+    def _all_vectors(self):
+        """Tutti gli ID e i vettori presenti nell'indice"""
+        ids  = faiss.vector_to_array(self.index.id_map).astype("int64")
+        vecs = self.index.index.reconstruct_n(0, self.index.ntotal)
+        return ids, vecs
+
+    def _live_vectors(self):
+        """Copia di ID e vettori non eliminati, da cui ricostruire l'indice"""
+        ids, vecs = self._all_vectors()
+        keep = ~np.isin(ids, np.fromiter(self.tombstones, dtype="int64"))
+        return ids[keep], vecs[keep]
+
+    def _rebuild(self):
+        """Ricostruisce l'indice del tipo configurato con i vettori attuali (senza tombstone)"""
+        old_kind = self._index_kind()
+        ids, vecs = self._live_vectors()
+        self.index = self._build_index(ids, vecs)
+        self.tombstones.clear()
+        self._params = None
+        logger.info(f"🔁 Indice ricostruito: {old_kind} -> {self._index_kind()} ({len(ids)} vettori)")
+
+    def _should_purge(self) -> bool:
+        """True se i vettori eliminati sono abbastanza da valere una ricostruzione senza di essi"""
+        return len(self.tombstones) >= max(TOMBSTONE_MIN, TOMBSTONE_RATIO * self.index.ntotal)
+
+    def _swap_index(self, index, purged: set, watermark: int):
+        """
+        Sostituisce l'indice ricostruito fuori dal lock, dopo avervi copiato le aggiunte
+        arrivate nel frattempo: a giri senza lock, l'ultimo residuo sotto lock
+        """
+        copied = set()
+        for round in range(SWAP_ROUNDS + 1):
+            with self._lock:
+                pending, self._pending = self._pending, []
+                # Una sola aggiunta per giro: molte piccole aggiunte all'HNSW costano molto di più
+                ids  = np.concatenate([ids for ids, _ in pending]) if pending else np.zeros(0, dtype="int64")
+                embs = np.concatenate([embs for _, embs in pending]) if pending else None
+                if round == SWAP_ROUNDS or len(ids) <= SWAP_BACKLOG:
+                    alive = np.fromiter((int(idx) in self.id_map for idx in ids), dtype=bool, count=len(ids))
+                    if alive.any():
+                        index.add_with_ids(embs[alive], ids[alive])
+                    old_kind = self._index_kind()
+                    self.index    = index
+                    self._pending = None
+                    # Tombstone: eliminati durante la ricostruzione (presenti nella copia o già ricopiati)
+                    self.tombstones = ({idx for idx in self.tombstones - purged if idx < watermark}
+                                       | {idx for idx in copied if idx not in self.id_map})
+                    self._params = None
+                    logger.info(f"🔁 Indice ricostruito: {old_kind} -> {self._index_kind()} ({index.ntotal} vettori)")
+                    return
+            index.add_with_ids(embs, ids)
+            copied.update(ids.tolist())
+
+    def _search_params(self):
+        """Parametri FAISS che escludono i tombstone dalla ricerca (None se non ce ne sono)"""
+        if not self.tombstones:
+            return None
+        if self._params is None:
+            ids = np.fromiter(self.tombstones, dtype="int64")
+            selector = faiss.IDSelectorNot(faiss.IDSelectorBatch(ids))
+            base = faiss.downcast_index(self.index.index)
+            if isinstance(base, faiss.IndexIVF):
+                params = faiss.SearchParametersIVF(sel=selector, nprobe=base.nprobe)
+            else:
+                params = faiss.SearchParameters(sel=selector)
+            # Si tengono i riferimenti: FAISS non possiede il selettore
+            self._params = (params, selector)
+        return self._params[0]
+
+    def _search(self, embs, top_k: int):
+        """Ricerca sull'indice ignorando gli elementi eliminati (chiamare con il lock)"""
+        with metrics.timer("faiss_search"):
+            return self.index.search(embs, top_k, params=self._search_params())
+
+    def _text(self, idx: int):
+        """Testo di un ID (None se eliminato o inesistente; chiamare con il lock)"""
+        return self.id_map.get(idx)
+
     # ---------- caricamento / salvataggio ----------
     def _load(self):
-        if os.path.exists(INDEX_PATH):
-            self.index = faiss.read_index(INDEX_PATH)
+        os.makedirs(self.store_dir, exist_ok=True)
+        rebuilt = False
+        meta = _read_meta(self.meta_path)
+        if meta is not None:
+            self._load_snapshot(meta)
+        elif os.path.exists(self.index_path):
+            # Formato precedente: si carica e si riscrive subito nel nuovo
+            self.index = faiss.read_index(self.index_path)
+            rebuilt    = True
             # Se per qualche motivo non fosse IDMap, creane uno nuovo vuoto:
             if not isinstance(self.index, faiss.IndexIDMap):
                 print("⚠️  Vecchio indice non compatibile: sarà ricreato da zero.")
-                base        = faiss.IndexFlatL2(self.dim)
-                self.index  = faiss.IndexIDMap(base)
+                self.index  = self._build_index()
                 self.id_map = {}
-                self.save()
             else:
-                with open(MAPPING_PATH, "rb") as f:
-                    self.id_map = pickle.load(f)
+                self._load_mapping()
+                if self._index_kind() == "ivf":
+                    self._trained_on = self.index.ntotal
         else:
-            base       = faiss.IndexFlatL2(self.dim)
-            self.index = faiss.IndexIDMap(base)
+            self.index = self._build_index()
             self.id_map = {}
 
+        # Recupera le modifiche successive all'ultima compattazione
+        self._replay_wal()
+        self._wal = open(self.wal_path, "ab")
+
+        # Migrazione automatica (es. indice flat esistente -> hnsw)
+        if self._needs_rebuild():
+            self._rebuild()
+            rebuilt = True
+
+        if rebuilt:
+            self.save()
+
+    def _snapshot_paths(self, generation: int) -> tuple:
+        """(indice FAISS, indice dei testi, testi) dello snapshot di una generazione"""
+        return tuple(os.path.join(self.store_dir, name.format(generation))
+                     for name in (SNAPSHOT_INDEX, SNAPSHOT_TEXT_INDEX, SNAPSHOT_TEXT_DATA))
+
+    def _load_snapshot(self, meta: dict):
+        """Carica in RAM (per poterlo modificare) lo snapshot descritto da meta"""
+        index_path, text_index, text_data = self._snapshot_paths(meta["generation"])
+        self.index = faiss.read_index(index_path)
+        texts = TextStore(text_index, text_data)
+        try:
+            self.id_map = dict(texts.items())
+        finally:
+            texts.close()
+        self.generation = meta["generation"]
+        self.next_id    = meta["next_id"]
+        self.tombstones = set(meta["tombstones"])
+        if self._index_kind() == "ivf":
+            self._trained_on = self.index.ntotal
+
+    def _load_mapping(self):
+        """Carica mappa, prossimo ID e tombstone (anche dal vecchio formato: solo la mappa)"""
+        with open(self.mapping_path, "rb") as f:
+            data = pickle.load(f)
+
+        if isinstance(data, dict) and "next_id" in data:
+            self.id_map     = data["id_map"]
+            self.next_id    = data["next_id"]
+            self.tombstones = set(data["tombstones"])
+            return
+
+        # Vecchio formato: ID ricavati dal contenuto; i vettori senza testo sono tombstone
+        self.id_map = data
+        index_ids   = faiss.vector_to_array(self.index.id_map).astype("int64")
+        known       = set(self.id_map) | set(index_ids.tolist())
+        self.next_id    = max(known) + 1 if known else 0
+        self.tombstones = set(index_ids.tolist()) - set(self.id_map)
+
+    def _replay_wal(self):
+        """Riapplica il WAL sopra l'ultimo snapshot (idempotente: sicuro dopo un crash)"""
+        if not os.path.exists(self.wal_path):
+            return
+
+        with open(self.wal_path, "rb") as f:
+            records, valid, error = _read_wal(f)
+        if error is not None:
+            # Scrittura interrotta da un crash: si scarta la coda del log
+            logger.warning(f"⚠️ WAL troncato dopo {len(records)} record: {error}")
+        if valid < os.path.getsize(self.wal_path):
+            with open(self.wal_path, "r+b") as f:
+                f.truncate(valid)
+
+        # Le aggiunte già nello snapshot sono saltate,
+        # le eliminazioni di vettori presenti nell'indice diventano tombstone
+        snapshot_next  = self.next_id
+        added, deleted = _net_changes(records, snapshot_next)
+        for idx in deleted:
+            self.id_map.pop(idx, None)
+            if idx < snapshot_next:
+                self.tombstones.add(idx)
+        self._params = None
+        if added or deleted:
+            self.next_id = max([self.next_id, *(idx + 1 for idx in added), *(idx + 1 for idx in deleted)])
+        if added:
+            ids  = np.array(list(added), dtype="int64")
+            vecs = _normalize_rows(np.stack([vec for _, vec in added.values()]))
+            self.index.add_with_ids(vecs, ids)
+            self.id_map.update({idx: text for idx, (text, _) in added.items()})
+
+        self._wal_records = len(records)
+        if records:
+            logger.info(f"♻️ Recuperati {len(records)} record dal WAL della memoria semantica")
+
+    def _log(self, *records: dict):
+        """Accoda record al WAL e li rende persistenti con un solo fsync (chiamare con il lock)"""
+        data = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+        self._wal.write(data.encode("utf-8"))
+        self._wal.flush()
+        os.fsync(self._wal.fileno())
+        self._wal_records += len(records)
+
+        threshold = max(COMPACT_MIN, COMPACT_RATIO * self.index.ntotal)
+        if self._wal_records >= threshold and not self._compacting:
+            self._compacting = True
+            threading.Thread(target=self._compact, name="semantic-memory-compaction", daemon=True).start()
+
+    def _compact(self):
+        """Compattazione in background avviata da _log"""
+        try:
+            self.save()
+        except Exception as e:
+            logger.error(f"Errore nella compattazione della memoria semantica: {e}")
+        finally:
+            with self._lock:
+                self._compacting = False
+
     def save(self):
-        # Salviamo *tutto* l’indice IDMap (ID + vettori)
-        faiss.write_index(self.index, INDEX_PATH)
-        with open(MAPPING_PATH, "wb") as f:
-            pickle.dump(self.id_map, f)
+        """
+        Compatta: scrive un nuovo snapshot (indice, testi, meta.json per ultimo) e rimuove
+        dal WAL i record inclusi. I lettori passano allo snapshot nuovo quando cambia meta.json.
+        """
+        with self._compact_lock:
+            # Sotto lock solo le copie; ricostruzione e scrittura su disco senza bloccare add/search
+            with self._lock:
+                rebuild = self._needs_rebuild() or self._should_purge()
+                if rebuild:
+                    ids, vecs = self._live_vectors()
+                    purged    = set(self.tombstones)
+                    self._pending = []
+                else:
+                    data  = faiss.serialize_index(self.index)
+                    index = self.index
+                mapping = dict(self.id_map)
+                meta    = {"next_id": self.next_id, "tombstones": [] if rebuild else sorted(self.tombstones)}
+                offset  = self._wal.tell() if self._wal else 0
+                self.generation += 1
+                meta["generation"] = self.generation
 
-    # ---------- operazioni di memoria ----------
-    def add(self, text: str):
-        text_norm = normalize(text)
-        emb       = model.encode([text_norm]).astype("float32")
-        idx       = len(self.id_map)
-        self.index.add_with_ids(emb, np.array([idx]))
-        self.id_map[idx] = text_norm
+            if rebuild:
+                # Addestramento (IVF) o costruzione del grafo (HNSW) sulla copia dei vettori.
+                # Lo snapshot è l'indice ricostruito: ciò che arriva nel frattempo è nel WAL dopo `offset`
+                try:
+                    index = self._build_index(ids, vecs)
+                    data  = faiss.serialize_index(index)
+                except BaseException:
+                    with self._lock:
+                        self._pending = None
+                    raise
+                meta["index_type"], meta["vectors"] = self._index_kind(index), int(index.ntotal)
+                self._swap_index(index, purged, meta["next_id"])
+            else:
+                meta["index_type"], meta["vectors"] = self._index_kind(index), int(index.ntotal)
+
+            # Salviamo *tutto* l’indice IDMap (ID + vettori)
+            index_path, text_index, text_data = self._snapshot_paths(meta["generation"])
+            text_entries, text_blob = encode_texts(sorted(mapping.items()))
+            _atomic_write(index_path, data.tobytes())
+            _atomic_write(text_index, text_entries)
+            _atomic_write(text_data, text_blob)
+            _atomic_write(self.meta_path, json.dumps(meta).encode("utf-8"))
+
+            with self._lock:
+                self._truncate_wal(offset)
+            self._remove_stale(meta["generation"])
+
+    def _remove_stale(self, generation: int):
+        """
+        Elimina gli snapshot precedenti e i file del vecchio formato. Chi li ha ancora
+        aperti in memory map continua a leggerli finché non passa al nuovo.
+        """
+        current = set(self._snapshot_paths(generation))
+        for name in os.listdir(self.store_dir):
+            path = os.path.join(self.store_dir, name)
+            stale = name in (INDEX_FILE, MAPPING_FILE) or (
+                name.startswith(("faiss.", "texts.")) and not name.endswith(".tmp") and path not in current)
+            if stale:
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    logger.debug(f"Snapshot {name} non rimosso: {e}")
+
+    def _truncate_wal(self, offset: int):
+        """Elimina dal WAL i primi `offset` byte, già presenti nello snapshot"""
+        if self._wal:
+            self._wal.close()
+        tail = b""
+        if os.path.exists(self.wal_path):
+            with open(self.wal_path, "rb") as f:
+                f.seek(offset)
+                tail = f.read()
+        _atomic_write(self.wal_path, tail)
+        self._wal = open(self.wal_path, "ab")
+        self._wal_records = tail.count(b"\n")
+
+    def close(self):
+        """Compatta e chiude il WAL (da chiamare allo spegnimento)"""
         self.save()
+        with self._lock:
+            if self._wal:
+                self._wal.close()
+                self._wal = None
+
+    # ---------- operazioni di memoria ----------
+    def add(self, text: str, emb=None) -> int:
+        """Aggiunge un testo e restituisce il suo ID"""
+        return self.add_batch([text], None if emb is None else _as_query(emb))[0]
 
-    def search(self, query: str, top_k: int = 1) -> str:
-        query_norm = normalize(query)
-        emb        = model.encode([query_norm]).astype("float32")
-        D, I       = self.index.search(emb, top_k)
+    def add_batch(self, texts, embs=None) -> list:
+        """Aggiunge più testi con un solo add_with_ids e una sola scrittura del WAL"""
+        if not texts:
+            return []
+        texts_norm = [normalize(text) for text in texts]
+        if embs is None:
+            embs = embeddings.embed_many(texts_norm)
+        embs = _normalize_rows(np.asarray(embs, dtype="float32").reshape(len(texts_norm), -1))
+        with self._lock:
+            start = self.next_id
+            ids   = np.arange(start, start + len(texts_norm), dtype="int64")
+            self.next_id += len(texts_norm)
+            self.index.add_with_ids(embs, ids)
+            self.id_map.update(zip(ids.tolist(), texts_norm))
+            if self._pending is not None:
+                self._pending.append((ids, embs))
+            self._log(*({"op": "add", "id": int(idx), "text": text_norm,
+                         "vec": base64.b64encode(emb.tobytes()).decode("ascii")}
+                        for idx, text_norm, emb in zip(ids, texts_norm, embs)))
+        return ids.tolist()
 
-        if I[0][0] == -1:
-            return ""
+    def bulk_load(self, texts, embs=None, save: bool = True) -> list:
+        """
+        Import massivo (seed, migrazioni): aggiunge senza passare dal WAL, quindi i dati
+        sono persistenti solo dopo save(). Per le scritture normali usare add_batch.
+        """
+        if not texts:
+            return []
+        texts_norm = [normalize(text) for text in texts]
+        if embs is None:
+            embs = embeddings.embed_many(texts_norm)
+        embs = _normalize_rows(np.asarray(embs, dtype="float32").reshape(len(texts_norm), -1))
+        with self._lock:
+            ids = np.arange(self.next_id, self.next_id + len(texts_norm), dtype="int64")
+            self.next_id += len(texts_norm)
+            self.index.add_with_ids(embs, ids)
+            self.id_map.update(zip(ids.tolist(), texts_norm))
+            if self._pending is not None:
+                self._pending.append((ids, embs))
+        if save:
+            self.save()
+        return ids.tolist()
 
-        distance = D[0][0]
-        idx      = I[0][0]
+    def delete(self, ids) -> int:
+        """Elimina (tombstone) gli ID dati; restituisce quanti erano presenti"""
+        with self._lock:
+            removed = [int(idx) for idx in ids if int(idx) in self.id_map]
+            if not removed:
+                return 0
+            for idx in removed:
+                del self.id_map[idx]
+            self.tombstones.update(removed)
+            self._params = None
+            self._log(*({"op": "del", "id": idx} for idx in removed))
+            return len(removed)
 
-        # ritorna il contesto solo se abbastanza “vicino”
-        return self.id_map[idx] if distance > 0.8 else ""
+    def update(self, idx: int, text: str, emb=None):
+        """Sostituisce il testo di un ID; restituisce il nuovo ID (o None se idx non esiste)"""
+        with self._lock:
+            if not self.delete([idx]):
+                return None
+            return self.add(text, emb)
+
+    def retrieve(self, query: str, top_k: int = CONTEXT_TOP_K, min_score: float = MIN_SCORE,
+                 emb=None, exclude_query: bool = False) -> list:
+        """Ricordi più simili alla domanda: [(testo, score)] con score decrescente"""
+        return self.retrieve_batch([query], top_k=top_k, min_score=min_score, embs=emb,
+                                   exclude_query=exclude_query)[0]
+
+    def retrieve_batch(self, queries, top_k: int = CONTEXT_TOP_K, min_score: float = MIN_SCORE,
+                       embs=None, exclude_query: bool = False) -> list:
+        """
+        Una sola ricerca FAISS per più domande. Per ciascuna restituisce fino a top_k
+        ricordi distinti con similarità coseno >= min_score.
+        Con exclude_query si scartano i ricordi identici alla domanda stessa.
+        """
+        if not queries:
+            return []
+        if embs is None:
+            embs = embeddings.embed_many(queries)
+        embs = _normalize_rows(np.asarray(embs, dtype="float32").reshape(len(queries), -1))
+
+        # Se ne chiedono di più per compensare i duplicati scartati
+        with self._lock:
+            D, I  = self._search(embs, top_k * 2)
+            texts = [[self._text(int(idx)) for idx in row] for row in I]
+
+        results = []
+        for query, scores, row_texts in zip(queries, D, texts):
+            seen = {normalize(query)} if exclude_query else set()
+            hits = []
+            for score, text in zip(scores, row_texts):
+                if score < min_score or len(hits) == top_k:
+                    break   # risultati ordinati per score decrescente
+                if text is None or text in seen:
+                    continue
+                seen.add(text)
+                hits.append((text, float(score)))
+            results.append(hits)
+        return results
+
+    def context(self, query: str, emb=None, max_tokens: int = CONTEXT_TOKENS) -> str:
+        """Contesto per il prompt: ricordi rilevanti (esclusa la domanda) entro il budget di token"""
+        return self.context_batch([query], embs=emb, max_tokens=max_tokens)[0]
+
+    def context_batch(self, queries, embs=None, max_tokens: int = CONTEXT_TOKENS) -> list:
+        """Versione batch di context"""
+        hits = self.retrieve_batch(queries, embs=embs, exclude_query=True)
+        return [pack_context(query_hits, max_tokens) for query_hits in hits]
+
+    def search(self, query: str, top_k: int = 1, emb=None) -> str:
+        """Il ricordo più simile (o "" se nessuno supera MIN_SCORE)"""
+        return self.search_batch([query], top_k=top_k, embs=emb)[0]
+
+    def search_batch(self, queries, top_k: int = 1, embs=None) -> list:
+        """Versione batch di search"""
+        hits = self.retrieve_batch(queries, top_k=top_k, embs=embs)
+        return [query_hits[0][0] if query_hits else "" for query_hits in hits]
 
     def learn(self, old_input: str, corrected_input: str):
-        old_norm = normalize(old_input)
-        emb      = model.encode([old_norm]).astype("float32")
-        D, I     = self.index.search(emb, 1)
-        idx      = I[0][0]
-
-        # rimuovi il vecchio, se esiste
-        if idx != -1 and idx in self.id_map:
-            self.index.remove_ids(np.array([idx]))
-            del self.id_map[idx]
-
-        # aggiungi la versione corretta
-        self.add(corrected_input)
+        emb      = _normalize_rows(embeddings.embed(old_input))
+        with self._lock:
+            D, I     = self._search(emb, 1)
+            idx      = int(I[0][0])
+
+            # sostituisci il vecchio, se esiste ed è davvero simile, con la versione corretta
+            if idx == -1 or D[0][0] < MIN_SCORE or self.update(idx, corrected_input) is None:
+                self.add(corrected_input)
+
+    # ---------- diagnostica ----------
+    def evaluate(self, n_queries: int = 100, k: int = 10) -> dict:
+        """
+        Confronta l'indice attuale con la ricerca esatta su un campione dei vettori memorizzati:
+        restituisce recall@k e latenze medie/p95 (ms) per scegliere il compromesso.
+        """
+        with self._lock:
+            ids, vecs = self._all_vectors()
+            live      = ~np.isin(ids, np.fromiter(self.tombstones, dtype="int64"))
+            ids, vecs = ids[live], vecs[live]
+            if not len(ids):
+                return {"index_type": self._index_kind(), "vectors": 0}
+
+            rng     = np.random.default_rng(0)
+            sample  = rng.choice(len(ids), size=min(n_queries, len(ids)), replace=False)
+            queries = vecs[sample]
+            k       = min(k, len(ids))
+
+            exact = faiss.IndexIDMap(faiss.IndexFlatIP(self.dim))
+            exact.add_with_ids(vecs, ids)
+
+            def timed_search(index):
+                latencies, results = [], []
+                for q in queries:
+                    start = time.perf_counter()
+                    _, I = index.search(q.reshape(1, -1), k, params=self._search_params() if index is self.index else None)
+                    latencies.append((time.perf_counter() - start) * 1000)
+                    results.append(I[0])
+                return results, np.array(latencies)
+
+            exact_res, exact_lat = timed_search(exact)
+            ann_res, ann_lat     = timed_search(self.index)
+
+        recall = np.mean([len(set(a) & set(e)) / k for a, e in zip(ann_res, exact_res)])
+        report = {
+            "index_type": self._index_kind(),
+            "vectors": len(ids),
+            "k": k,
+            f"recall@{k}": float(recall),
+            "latency_ms": {"mean": float(ann_lat.mean()), "p95": float(np.percentile(ann_lat, 95))},
+            "exact_latency_ms": {"mean": float(exact_lat.mean()), "p95": float(np.percentile(exact_lat, 95))},
+        }
+        logger.info(f"📊 Valutazione indice: {report}")
+        return report
+
+class ReadOnlyMemoryError(RuntimeError):
+    """Modifica richiesta a una memoria aperta in sola lettura"""
+
+# Tentativi di apertura dello snapshot se lo scrittore lo sostituisce nel frattempo
+SNAPSHOT_RETRIES = 3
+
+def _stat_key(path: str):
+    """Identità di un file (inode, mtime, dimensione); None se non esiste"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
+class SemanticMemoryReader(SemanticMemory):
+    """
+    Memoria semantica in sola lettura per i worker che non scrivono (vedi memory.workers).
+    Lo snapshot si apre in memory map, sia l'indice FAISS sia i testi: le pagine stanno nella
+    page cache e sono condivise da tutti i processi. Le modifiche successive allo snapshot
+    si leggono dal WAL in un piccolo indice in RAM.
+
+    Prima di ogni ricerca due stat dicono se lo scrittore ha pubblicato un nuovo snapshot
+    (meta.json) o accodato record al WAL: si ricarica solo ciò che è cambiato.
+    """
+
+    def __init__(self, index_type: str = None, store_dir: str = STORE_DIR):
+        self.texts          = {}     # TextStore dello snapshot (dizionario per il formato precedente)
+        self._overlay       = None   # indice in RAM con le aggiunte lette dal WAL
+        self._overlay_texts = {}
+        self._snapshot_key  = None   # _stat_key dello snapshot aperto
+        self._snapshot_next = 0      # gli ID inferiori sono già nello snapshot
+        self._snapshot_tombstones = set()
+        self._wal_key       = None   # inode del WAL letto
+        self._wal_offset    = 0      # byte del WAL già applicati
+        super().__init__(index_type, store_dir)
+
+    def _load(self):
+        self._refresh()
+
+    def _refresh(self):
+        """Passa all'ultimo snapshot e applica i record nuovi del WAL (chiamare con il lock)"""
+        snapshot_key = _stat_key(self.meta_path) or _stat_key(self.index_path)
+        if self.index is None or snapshot_key != self._snapshot_key:
+            self._open_snapshot()
+
+        try:
+            st = os.stat(self.wal_path)
+        except FileNotFoundError:
+            if self._wal_offset:
+                self._reset_overlay()
+            return
+        if st.st_ino != self._wal_key or st.st_size < self._wal_offset:
+            # WAL riscritto dalla compattazione (o troncato dopo un crash): si rilegge da capo
+            self._reset_overlay()
+            self._wal_key = st.st_ino
+        if st.st_size > self._wal_offset:
+            self._read_wal_tail()
+
+    def _open_snapshot(self):
+        """Apre in memory map lo snapshot corrente, riprovando se viene sostituito nel frattempo"""
+        for attempt in range(SNAPSHOT_RETRIES):
+            try:
+                key  = _stat_key(self.meta_path)
+                meta = _read_meta(self.meta_path)
+                if meta is not None:
+                    index_path, text_index, text_data = self._snapshot_paths(meta["generation"])
+                    index = faiss.read_index(index_path, MMAP_FLAGS)
+                    texts = TextStore(text_index, text_data)
+                    self._use_snapshot(key, meta["generation"], index, texts, meta["next_id"], meta["tombstones"])
+                elif os.path.exists(self.index_path):
+                    # Formato precedente, non ancora migrato dallo scrittore
+                    key = _stat_key(self.index_path)
+                    self.index = faiss.read_index(self.index_path, MMAP_FLAGS)
+                    self._load_mapping()
+                    self._use_snapshot(key, 0, self.index, self.id_map, self.next_id, self.tombstones)
+                else:
+                    self._use_snapshot(None, 0, self._build_index(), {}, 0, ())
+                return
+            except FileNotFoundError:
+                if attempt == SNAPSHOT_RETRIES - 1:
+                    raise
+
+    def _use_snapshot(self, key, generation: int, index, texts, next_id: int, tombstones):
+        old_texts = self.texts
+        self.index, self.texts = index, texts
+        self.generation     = generation
+        self._snapshot_key  = key
+        self._snapshot_next = next_id
+        self._snapshot_tombstones = set(tombstones)
+        if isinstance(old_texts, TextStore) and old_texts is not texts:
+            old_texts.close()
+        self._reset_overlay()
+        self._wal_key = None
+
+    def _reset_overlay(self):
+        """Torna allo stato dello snapshot, da riportare in pari rileggendo il WAL da capo"""
+        self._overlay       = faiss.IndexIDMap(faiss.IndexFlatIP(self.dim))
+        self._overlay_texts = {}
+        self.tombstones     = set(self._snapshot_tombstones)
+        self.next_id        = self._snapshot_next
+        self._params        = None
+        self._wal_offset    = 0
+
+    def _read_wal_tail(self):
+        """Applica i record del WAL non ancora letti"""
+        with open(self.wal_path, "rb") as f:
+            f.seek(self._wal_offset)
+            # Un record a metà è una scrittura ancora in corso: lo si rilegge la volta successiva
+            records, valid, _ = _read_wal(f)
+        self._wal_offset += valid
+
+        added, deleted = _net_changes(records, self._snapshot_next)
+        removed = [idx for idx in deleted if self._overlay_texts.pop(idx, None) is not None]
+        if removed:
+            self._overlay.remove_ids(np.array(removed, dtype="int64"))
+        tombstones = {idx for idx in deleted if idx < self._snapshot_next} - self.tombstones
+        if tombstones:
+            self.tombstones |= tombstones
+            self._params = None
+        if added:
+            ids  = np.array(list(added), dtype="int64")
+            vecs = _normalize_rows(np.stack([vec for _, vec in added.values()]))
+            self._overlay.add_with_ids(vecs, ids)
+            self._overlay_texts.update({idx: text for idx, (text, _) in added.items()})
+        if added or deleted:
+            self.next_id = max([self.next_id, *(idx + 1 for idx in added), *(idx + 1 for idx in deleted)])
+
+    def _search(self, embs, top_k: int):
+        """Ricerca sullo snapshot e sulle aggiunte recenti, risultati uniti per score"""
+        self._refresh()
+        D, I = super()._search(embs, top_k)
+        if not self._overlay.ntotal:
+            return D, I
+        D_new, I_new = self._overlay.search(embs, top_k)
+        D, I  = np.hstack([D, D_new]), np.hstack([I, I_new])
+        order = np.argsort(-D, axis=1, kind="stable")[:, :top_k]
+        return np.take_along_axis(D, order, axis=1), np.take_along_axis(I, order, axis=1)
+
+    def _text(self, idx: int):
+        text = self._overlay_texts.get(idx)
+        return text if text is not None else self.texts.get(idx)
+
+    def _read_only(self, *args, **kwargs):
+        raise ReadOnlyMemoryError("Memoria in sola lettura: le modifiche passano dallo scrittore")
+
+    # Le modifiche (update passa da delete) sono dello scrittore
+    add_batch = bulk_load = delete = learn = save = _read_only
+
+    def close(self):
+        """Rilascia le memory map (non c'è niente da salvare)"""
+        with self._lock:
+            if isinstance(self.texts, TextStore):
+                self.texts.close()
+            self.texts, self.index, self._overlay = {}, None, None
@@ -0,0 +1,55 @@
+import io
+import mmap
+import numpy as np
+
+# Una voce per testo, ordinate per ID: posizione e lunghezza (byte UTF-8) nel file dei testi
+ENTRY = np.dtype([("id", "<i8"), ("offset", "<i8"), ("length", "<i8")])
+
+def encode(items) -> tuple:
+    """(indice in formato .npy, testi concatenati) per coppie (id, testo) ordinate per ID"""
+    ids  = [idx for idx, _ in items]
+    data = [text.encode("utf-8") for _, text in items]
+    entries = np.zeros(len(items), dtype=ENTRY)
+    entries["id"]     = ids
+    entries["length"] = [len(chunk) for chunk in data]
+    entries["offset"] = np.cumsum(entries["length"]) - entries["length"]
+    buffer = io.BytesIO()
+    np.save(buffer, entries)
+    return buffer.getvalue(), b"".join(data)
+
+class TextStore:
+    """
+    Testi della memoria semantica letti in memory map: l'indice si cerca per bisezione e ogni
+    testo si decodifica solo quando serve, quindi i processi che lo aprono condividono le pagine
+    (page cache) invece di tenerne ciascuno una copia come con il dizionario in pickle.
+    """
+
+    def __init__(self, index_path: str, data_path: str):
+        self._entries = np.load(index_path, mmap_mode="r")
+        self._ids     = self._entries["id"]
+        with open(data_path, "rb") as f:
+            # Un file vuoto non si può mappare
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if f.seek(0, 2) else b""
+
+    def get(self, idx: int, default=None):
+        i = int(np.searchsorted(self._ids, idx))
+        if i == len(self._ids) or self._ids[i] != idx:
+            return default
+        entry = self._entries[i]
+        start = int(entry["offset"])
+        return self._data[start:start + int(entry["length"])].decode("utf-8")
+
+    def items(self):
+        """Tutte le coppie (id, testo) in ordine di ID"""
+        for idx, start, length in self._entries.tolist():
+            yield idx, self._data[start:start + length].decode("utf-8")
+
+    def __len__(self):
+        return len(self._ids)
+
+    def close(self):
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._data    = b""
+        self._entries = np.zeros(0, dtype=ENTRY)
+        self._ids     = self._entries["id"]
@@ -0,0 +1,274 @@
+import os
+import json
+import socket
+import asyncio
+import logging
+
+try:
+    import fcntl
+except ImportError:   # Windows: niente lock tra processi, si usa un solo worker
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+WRITER_LOCK   = "memory/writer.lock"
+WRITER_SOCKET = "memory/writer.sock"
+RECONNECT_DELAY = 0.5      # secondi tra un tentativo di connessione allo scrittore e l'altro
+CLOSE_TIMEOUT   = 5.0      # secondi concessi allo spegnimento per inoltrare ciò che resta
+MAX_LINE        = 2 ** 24  # byte massimi di un messaggio (una risposta lunga dell'LLM)
+REQUEST_TIMEOUT = 5.0      # secondi massimi per una richiesta con risposta (timer)
+
+class WriterUnavailableError(RuntimeError):
+    """Il worker che scrive la memoria (e gestisce i timer) non risponde"""
+
+def acquire_writer_lock(path: str = WRITER_LOCK):
+    """
+    Con più worker (uvicorn --workers N) la memoria ha un solo scrittore: il primo processo
+    che ottiene il lock. Restituisce il file del lock, da tenere aperto finché si scrive
+    (il lock si rilascia anche se il processo muore), oppure None se scrive un altro processo.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    lock = open(path, "a")
+    if fcntl is None:
+        return lock
+    try:
+        fcntl.flock(lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock.close()
+        return None
+    return lock
+
+def _encode(message: dict) -> bytes:
+    """Un messaggio del protocollo tra worker: una riga JSON"""
+    return (json.dumps(message, ensure_ascii=False) + "\n").encode("utf-8")
+
+class WriterIntake:
+    """
+    Lato scrittore: riceve su un socket Unix le scritture inoltrate dagli altri worker
+    (un JSON per riga) e le applica come le proprie, tramite MemoryWriter.
+    Gestisce anche i timer per conto degli altri worker: schedule, cancel e list ricevono
+    una riga di risposta, e chi si iscrive riceve ogni timer che suona.
+    on_connect, se dato, si chiama a ogni connessione di un altro worker.
+    """
+
+    def __init__(self, namespaces, writer, scheduler, path: str = WRITER_SOCKET, on_connect=None):
+        self.namespaces  = namespaces
+        self.writer      = writer
+        self.scheduler   = scheduler
+        self.path        = path
+        self.on_connect  = on_connect
+        self._server     = None
+        self._subscribers = set()
+
+    async def start(self):
+        if not hasattr(asyncio, "start_unix_server"):
+            logger.warning("Socket Unix non disponibili: scritture degli altri worker non ricevute")
+            return
+        # Il socket di uno scrittore precedente resta sul disco: il lock garantisce che non sia in uso
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._handle, self.path, limit=MAX_LINE)
+        self.scheduler.add_listener(self._timer_fired)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        if self.on_connect is not None:
+            self.on_connect()
+        try:
+            while line := await reader.readline():
+                message, reply = {}, None
+                try:
+                    message = json.loads(line)
+                    reply = await self._apply(message, writer)
+                except Exception as e:
+                    logger.error(f"Richiesta inoltrata non applicata ({message.get('op')}): {e}")
+                    reply = {"error": str(e)}
+                if str(message.get("op", "")).startswith("timer_") and reply is not None:
+                    writer.write(_encode(reply))
+                    await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self._subscribers.discard(writer)
+            writer.close()
+
+    async def _apply(self, message: dict, writer: asyncio.StreamWriter):
+        """Applica un messaggio; per i timer restituisce la risposta da rimandare"""
+        op = message["op"]
+        if op == "save":
+            self.writer.submit(message["session"], message["user"], message["ai"])
+        elif op == "learn":
+            ns = await asyncio.to_thread(self.namespaces.get, message["session"])
+            await asyncio.to_thread(ns.sem_mem.learn, message["old"], message["new"])
+        elif op == "timer_schedule":
+            return {"timer": self.scheduler.schedule(message["seconds"], message["message"])}
+        elif op == "timer_cancel":
+            return {"cancelled": self.scheduler.cancel(message["id"])}
+        elif op == "timer_list":
+            return {"timers": self.scheduler.list()}
+        elif op == "timer_subscribe":
+            self._subscribers.add(writer)
+
+    async def _timer_fired(self, timer: dict):
+        """Inoltra un timer scaduto agli altri worker, che lo notificano ai propri client"""
+        line = _encode({"op": "timer_fired", "timer": timer})
+        for subscriber in list(self._subscribers):
+            try:
+                subscriber.write(line)
+                await subscriber.drain()
+            except ConnectionError:
+                self._subscribers.discard(subscriber)
+
+    async def close(self):
+        if self._server is None:
+            return
+        for subscriber in self._subscribers:
+            subscriber.close()
+        self._subscribers.clear()
+        self._server.close()
+        await self._server.wait_closed()
+        self._server = None
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+class ForwardingWriter:
+    """
+    Al posto di MemoryWriter nei worker che non scrivono: accoda le scritture e un task
+    le inoltra allo scrittore, riconnettendosi se questo viene riavviato.
+    """
+
+    def __init__(self, path: str = WRITER_SOCKET):
+        self.path   = path
+        self._queue = None
+        self._task  = None
+        self._loop  = None
+
+    def start(self):
+        """Avvia il task di inoltro sull'event loop corrente"""
+        self._loop  = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._task  = asyncio.create_task(self._run())
+
+    def submit(self, session_id: str, command: str, response: str):
+        """Inoltra un'interazione della sessione (da chiamare dall'event loop, non blocca)"""
+        self._queue.put_nowait({"op": "save", "session": session_id, "user": command, "ai": response})
+
+    def submit_correction(self, session_id: str, old_phrase: str, new_phrase: str):
+        """Inoltra una correzione (sicuro anche da altri thread)"""
+        message = {"op": "learn", "session": session_id, "old": old_phrase, "new": new_phrase}
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, message)
+
+    async def _run(self):
+        connection = None
+        try:
+            while (message := await self._queue.get()) is not None:
+                line = _encode(message)
+                while True:
+                    try:
+                        if connection is None:
+                            _, connection = await asyncio.open_unix_connection(self.path)
+                        connection.write(line)
+                        await connection.drain()
+                        break
+                    except OSError as e:
+                        logger.warning(f"Scrittore della memoria non raggiungibile ({e}), riprovo")
+                        connection = None
+                        await asyncio.sleep(RECONNECT_DELAY)
+        finally:
+            if connection is not None:
+                connection.close()
+
+    async def close(self):
+        """Inoltra ciò che è ancora in coda e ferma il task (da chiamare allo spegnimento)"""
+        if self._task is None:
+            return
+        self._queue.put_nowait(None)
+        try:
+            await asyncio.wait_for(self._task, CLOSE_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.error("Scritture in coda non inoltrate: scrittore della memoria non raggiungibile")
+        self._task = None
+
+class RemoteTimers:
+    """
+    Timer nei worker che non scrivono: schedule, cancel e list sono richieste allo scrittore,
+    che li tiene in un solo scheduler (e in un solo memory/timers.json). Chiamate bloccanti,
+    da fare fuori dall'event loop (comandi ed endpoint sincroni girano già su thread).
+    """
+
+    def __init__(self, path: str = WRITER_SOCKET, timeout: float = REQUEST_TIMEOUT):
+        self.path    = path
+        self.timeout = timeout
+
+    def _request(self, message: dict) -> dict:
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+                connection.settimeout(self.timeout)
+                connection.connect(self.path)
+                connection.sendall(_encode(message))
+                with connection.makefile("rb") as replies:
+                    line = replies.readline(MAX_LINE)
+        except OSError as e:
+            raise WriterUnavailableError(f"Scheduler dei timer non raggiungibile: {e}") from e
+        if not line:
+            raise WriterUnavailableError("Scheduler dei timer: connessione chiusa senza risposta")
+        reply = json.loads(line)
+        if "error" in reply:
+            raise RuntimeError(reply["error"])
+        return reply
+
+    def schedule(self, seconds: float, message: str) -> dict:
+        return self._request({"op": "timer_schedule", "seconds": seconds, "message": message})["timer"]
+
+    def cancel(self, timer_id: str) -> bool:
+        return self._request({"op": "timer_cancel", "id": timer_id})["cancelled"]
+
+    def list(self) -> list:
+        return self._request({"op": "timer_list"})["timers"]
+
+class TimerRelay:
+    """
+    Nei worker che non scrivono: riceve dallo scrittore i timer che suonano e li notifica
+    con `notify` ai client connessi a questo worker, riconnettendosi se lo scrittore riparte.
+    """
+
+    def __init__(self, notify, path: str = WRITER_SOCKET):
+        self.notify = notify
+        self.path   = path
+        self._task  = None
+
+    def start(self):
+        """Avvia il task sull'event loop corrente"""
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path, limit=MAX_LINE)
+            except OSError:
+                await asyncio.sleep(RECONNECT_DELAY)
+                continue
+            try:
+                writer.write(_encode({"op": "timer_subscribe"}))
+                await writer.drain()
+                while line := await reader.readline():
+                    message = json.loads(line)
+                    if message.get("op") == "timer_fired":
+                        try:
+                            await self.notify(message["timer"])
+                        except Exception as e:
+                            logger.error(f"Errore nella notifica del timer {message['timer']['id']}: {e}")
+            except ConnectionError:
+                pass
+            finally:
+                writer.close()
+            await asyncio.sleep(RECONNECT_DELAY)
+
+    async def close(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
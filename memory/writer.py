@@ -0,0 +1,115 @@
+import asyncio
+import logging
+
+import embeddings
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCH = 64      # interazioni salvate al massimo in un colpo
+MAX_DELAY = 0.05    # secondi di attesa per riempire un batch
+
+class MemoryWriter:
+    """
+    Unico scrittore della memoria: le interazioni vengono accodate e un solo task
+    le salva a micro-batch (un encode, un add_with_ids, una scrittura su disco per batch
+    e per namespace).
+
+    resolve(session_id) restituisce il namespace: si chiama nel thread di scrittura, così
+    il caricamento di una sessione non ancora in memoria non blocca l'event loop.
+    """
+
+    def __init__(self, resolve, max_batch: int = MAX_BATCH, max_delay: float = MAX_DELAY):
+        self.resolve   = resolve
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue    = None
+        self._task     = None
+        self._loop     = None
+
+    def start(self):
+        """Avvia il task di scrittura sull'event loop corrente"""
+        self._loop  = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._task  = asyncio.create_task(self._run())
+
+    def submit(self, session_id: str, command: str, response: str):
+        """Accoda un'interazione della sessione (da chiamare dall'event loop, non blocca)"""
+        self._queue.put_nowait((session_id, command, response))
+
+    def submit_close(self, namespace, callback):
+        """
+        Chiama callback(namespace) dopo aver salvato le sue scritture ancora in coda
+        (sicuro anche da altri thread: lo scaricamento può avvenire nel threadpool).
+        """
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, (namespace, callback, None))
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+
+            # Raccoglie altre interazioni arrivate nel frattempo, senza superare max_delay
+            deadline = loop.time() + self.max_delay
+            stop = False
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+
+            try:
+                with metrics.timer("memory_write"):
+                    await asyncio.to_thread(self._write, batch)
+            except Exception as e:
+                logger.error(f"Errore nel salvataggio di {len(batch)} interazioni: {e}")
+            if stop:
+                return
+
+    def _write(self, batch):
+        # Un solo encode per tutto il batch, poi una scrittura per namespace
+        interactions = [command for _, command, _ in batch if isinstance(command, str)]
+        embs = embeddings.embed_many(interactions)
+
+        pending = {}   # {namespace: [(comando, risposta, embedding)]}, in ordine di arrivo
+        row = 0
+        for target, command, response in batch:
+            if isinstance(command, str):
+                # Il namespace si risolve qui: nel frattempo può essere stato scaricato
+                ns = self.resolve(target)
+                pending.setdefault(ns, []).append((command, response, embs[row]))
+                row += 1
+                continue
+            # Richiesta di chiusura: prima si salva ciò che resta del namespace
+            self._flush(target, pending.pop(target, []))
+            command(target)
+
+        for ns, items in pending.items():
+            self._flush(ns, items)
+        logger.debug(f"{len(interactions)} interazioni salvate in memoria")
+
+    @staticmethod
+    def _flush(ns, items):
+        if not items:
+            return
+        commands = [command for command, _, _ in items]
+        ns.sem_mem.add_batch(commands, [emb for _, _, emb in items])
+        ns.history.extend([{"user": command, "ai": response} for command, response, _ in items])
+
+    async def close(self):
+        """Salva tutto ciò che è ancora in coda e ferma il task (da chiamare allo spegnimento)"""
+        if self._task is None:
+            return
+        self._queue.put_nowait(None)
+        await self._task
+        self._task = None
@@ -0,0 +1,197 @@
+# metrics.py
+
+import time
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+
+import numpy as np
+
+PREFIX = "assistant"
+
+# Limiti superiori (secondi) dei bucket degli istogrammi
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Campioni recenti tenuti per serie per calcolare p50/p95/p99
+WINDOW    = 1024
+QUANTILES = (0.5, 0.95, 0.99)
+
+# Tempi per fase della richiesta in corso (None fuori da una richiesta)
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+class Histogram:
+    """Istogramma cumulativo in stile Prometheus più una finestra di campioni per i quantili"""
+
+    def __init__(self, buckets=BUCKETS, window: int = WINDOW):
+        self.buckets = buckets
+        self.counts  = [0] * len(buckets)
+        self.sum     = 0.0
+        self.count   = 0
+        self.recent  = deque(maxlen=window)
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum   += value
+        self.count += 1
+        self.recent.append(value)
+
+    def quantiles(self, qs=QUANTILES) -> dict:
+        if not self.recent:
+            return {}
+        values = np.quantile(np.fromiter(self.recent, dtype="float64"), qs)
+        return dict(zip(qs, values.tolist()))
+
+class Metrics:
+    """
+    Registro delle metriche del processo: istogrammi di latenza e contatori con etichette.
+    Thread-safe; le osservazioni costano un lock e qualche somma.
+    """
+
+    def __init__(self):
+        self._histograms = {}   # {(nome, etichette): Histogram}
+        self._counters   = {}   # {(nome, etichette): valore}
+        self._lock       = threading.Lock()
+
+    @staticmethod
+    def _key(name: str, labels: dict):
+        """Chiave della serie: etichette None scartate, valori come stringhe (sempre ordinabili)"""
+        return name, tuple(sorted((key, str(value)) for key, value in labels.items() if value is not None))
+
+    def observe(self, name: str, seconds: float, **labels):
+        """Registra una durata nell'istogramma `name` con le etichette date"""
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """Incrementa il contatore `name` con le etichette date"""
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def record(self, stage: str, seconds: float):
+        """Registra la durata di una fase (istogramma stage_seconds e tempi della richiesta)"""
+        self.observe("stage_seconds", seconds, stage=stage)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def timer(self, stage: str):
+        """Misura un blocco come fase `stage`"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def timed(self, stage: str):
+        """Decoratore: misura ogni chiamata della funzione come fase `stage`"""
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(stage):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    # ---------- esportazione ----------
+    def snapshot(self) -> dict:
+        """Contatori e quantili in formato JSON-friendly"""
+        with self._lock:
+            histograms = {key: (h.count, h.sum, h.quantiles()) for key, h in self._histograms.items()}
+            counters   = dict(self._counters)
+        return {
+            "histograms": [
+                {"name": name, "labels": dict(labels), "count": count, "sum": total,
+                 **{f"p{int(q * 100)}": value for q, value in quantiles.items()}}
+                for (name, labels), (count, total, quantiles) in sorted(histograms.items())
+            ],
+            "counters": [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(counters.items())
+            ],
+        }
+
+    def render(self) -> str:
+        """Testo nel formato di esposizione di Prometheus"""
+        with self._lock:
+            histograms = {key: (list(h.counts), h.sum, h.count, h.quantiles(), h.buckets)
+                          for key, h in self._histograms.items()}
+            counters   = dict(self._counters)
+
+        lines = []
+        for name in sorted({name for name, _ in histograms}):
+            metric = f"{PREFIX}_{name}"
+            series = sorted(((labels, data) for (n, labels), data in histograms.items() if n == name),
+                            key=lambda item: item[0])
+
+            lines.append(f"# TYPE {metric} histogram")
+            for labels, (counts, total, count, _, buckets) in series:
+                cumulative = 0
+                for bound, bucket_count in zip(buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f"{metric}_bucket{_labels(labels, le=_number(bound))} {cumulative}")
+                lines.append(f"{metric}_bucket{_labels(labels, le='+Inf')} {count}")
+                lines.append(f"{metric}_sum{_labels(labels)} {_number(total)}")
+                lines.append(f"{metric}_count{_labels(labels)} {count}")
+
+            # Quantili sugli ultimi WINDOW campioni, pronti senza histogram_quantile()
+            lines.append(f"# TYPE {metric}_quantile gauge")
+            for labels, (_, _, _, quantiles, _) in series:
+                for q, value in quantiles.items():
+                    lines.append(f"{metric}_quantile{_labels(labels, quantile=_number(q))} {_number(value)}")
+
+        for name in sorted({name for name, _ in counters}):
+            metric = f"{PREFIX}_{name}_total"
+            lines.append(f"# TYPE {metric} counter")
+            for (n, labels), value in sorted(counters.items()):
+                if n == name:
+                    lines.append(f"{metric}{_labels(labels)} {_number(value)}")
+
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+def _number(value: float) -> str:
+    return repr(float(value))
+
+def _labels(labels, **extra) -> str:
+    items = list(labels) + list(extra.items())
+    if not items:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in items) + "}"
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+# ---------- tempi per richiesta ----------
+def start_request():
+    """Inizia a raccogliere i tempi per fase della richiesta corrente; restituisce il token per end_request"""
+    return _request_timings.set({})
+
+def end_request(token) -> dict:
+    """Termina la raccolta e restituisce {fase: secondi}"""
+    timings = _request_timings.get() or {}
+    _request_timings.reset(token)
+    return timings
+
+def server_timing(timings: dict, total: float = None) -> str:
+    """Valore dell'header Server-Timing (durate in millisecondi)"""
+    parts = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items()]
+    if total is not None:
+        parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+metrics = Metrics()
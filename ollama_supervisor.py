@@ -0,0 +1,201 @@
+# ollama_supervisor.py
+
+import time
+import asyncio
+import logging
+import subprocess
+import threading
+
+import httpx
+
+from llm_wrapper import OLLAMA_URL
+
+logger = logging.getLogger(__name__)
+
+PROBE_TIMEOUT          = 2.0    # secondi per un controllo di salute
+PROBE_INTERVAL         = 10.0   # tra due controlli quando lo stato è stabile
+STARTUP_PROBE_INTERVAL = 0.25   # controlli ravvicinati mentre Ollama si avvia
+STARTUP_TIMEOUT        = 30.0   # oltre, Ollama è segnato come non disponibile (si continua a controllare)
+MAX_RESTARTS           = 3      # riavvii automatici del processo prima di arrendersi
+READY_WAIT             = 5.0    # attesa massima di una richiesta LLM arrivata durante l'avvio
+
+# Stati possibili
+STOPPED     = "stopped"
+STARTING    = "starting"
+READY       = "ready"
+UNAVAILABLE = "unavailable"
+
+class OllamaUnavailableError(RuntimeError):
+    """Sollevata quando Ollama non è (ancora) pronto a rispondere"""
+
+class OllamaSupervisor:
+    """
+    Avvia e sorveglia `ollama serve` senza bloccare l'avvio: un task controlla lo stato
+    in background e lo tiene in cache, così /health risponde subito e i percorsi che non
+    usano l'LLM (comandi, memoria) sono serviti mentre il modello si scalda.
+    """
+
+    def __init__(self, base_url: str = OLLAMA_URL, command=("ollama", "serve")):
+        self.base_url   = base_url
+        self.command    = list(command)
+        self.state      = STOPPED
+        self.process    = None     # processo avviato da noi (None se Ollama era già attivo)
+        self.restarts   = 0
+        self.last_check = None     # time.time() dell'ultimo controllo
+        self.last_error = None
+        self._since     = None     # time.monotonic() dell'ultimo passaggio a "starting"
+        self.spawn      = True     # False: si controlla soltanto, Ollama lo avvia un altro processo
+        self._ready     = threading.Event()
+        self._loop      = None
+        self._task      = None
+
+    # ---------- ciclo di vita ----------
+    def start(self, loop: asyncio.AbstractEventLoop = None, spawn: bool = True):
+        """
+        Avvia la sorveglianza sul loop dato, oppure su un loop dedicato in background.
+        Con più worker solo uno (spawn=True) avvia Ollama, gli altri ne seguono lo stato.
+        """
+        if self._loop is not None:
+            return
+        self.spawn = spawn
+        if loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="ollama-supervisor", daemon=True).start()
+        self._loop = loop
+        self._set_state(STARTING)
+        self._task = asyncio.run_coroutine_threadsafe(self._run(), loop)
+
+    def stop(self):
+        """Ferma la sorveglianza e termina Ollama se è stato avviato da noi"""
+        if self._task is not None:
+            self._task.cancel()
+        self._loop = None
+        self._task = None
+        self._set_state(STOPPED)
+        self.terminate()
+
+    def terminate(self):
+        """Termina il processo Ollama avviato dal supervisore (idempotente)"""
+        process, self.process = self.process, None
+        if process is None or process.poll() is not None:
+            return
+        logger.info("🧹 Chiusura Ollama...")
+        process.terminate()
+        try:
+            process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        logger.info("✅ Ollama terminato")
+
+    async def _run(self):
+        async with httpx.AsyncClient(base_url=self.base_url, timeout=PROBE_TIMEOUT) as client:
+            while True:
+                if await self._probe(client):
+                    if self.state != READY:
+                        logger.info("✅ Ollama pronto")
+                    self._set_state(READY)
+                else:
+                    self._handle_down()
+                await asyncio.sleep(STARTUP_PROBE_INTERVAL if self.state == STARTING else PROBE_INTERVAL)
+
+    async def _probe(self, client: httpx.AsyncClient) -> bool:
+        try:
+            res = await client.get("/")
+            ok = res.status_code == 200
+            self.last_error = None if ok else f"HTTP {res.status_code}"
+        except httpx.HTTPError as e:
+            ok = False
+            self.last_error = str(e) or type(e).__name__
+        self.last_check = time.time()
+        return ok
+
+    def _handle_down(self):
+        """Ollama non risponde: lo (ri)avvia se serve e aggiorna lo stato"""
+        if self.state == READY:
+            logger.warning(f"⚠️ Ollama non raggiungibile: {self.last_error}")
+            self._set_state(STARTING)
+
+        if self.state == STARTING and self.spawn and self._process_exited():
+            if self.restarts > MAX_RESTARTS:
+                self._set_state(UNAVAILABLE)
+            elif not self._spawn():
+                self._set_state(UNAVAILABLE)
+
+        if self.state == STARTING and time.monotonic() - self._since > STARTUP_TIMEOUT:
+            logger.error(f"❌ Ollama non pronto dopo {STARTUP_TIMEOUT:.0f}s, continuo a controllare")
+            self._set_state(UNAVAILABLE)
+
+    def _process_exited(self) -> bool:
+        """Vero se non c'è un nostro processo in esecuzione (mai avviato o terminato)"""
+        return self.process is None or self.process.poll() is not None
+
+    def _spawn(self) -> bool:
+        try:
+            logger.info("⚙️ Avvio Ollama in background...")
+            self.process = subprocess.Popen(self.command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            self.restarts += 1
+            return True
+        except Exception as e:
+            logger.error(f"Errore nell'avvio di Ollama: {e}")
+            self.last_error = str(e)
+            self.restarts = MAX_RESTARTS + 1
+            return False
+
+    def _set_state(self, state: str):
+        if state == STARTING and self.state != STARTING:
+            self._since = time.monotonic()
+        self.state = state
+        if state == READY:
+            self._ready.set()
+        else:
+            self._ready.clear()
+
+    # ---------- stato ----------
+    @property
+    def ready(self) -> bool:
+        """Ultimo stato noto (non esegue controlli)"""
+        return self._ready.is_set()
+
+    @property
+    def alive(self) -> bool:
+        """Il supervisore è in funzione (liveness del servizio, indipendente da Ollama)"""
+        return self._task is not None and not self._task.done()
+
+    def status(self) -> dict:
+        """Istantanea dello stato in cache"""
+        return {
+            "state": self.state,
+            "ready": self.ready,
+            "supervising": self.alive,
+            "pid": self.process.pid if self.process is not None else None,
+            "restarts": self.restarts,
+            "last_check_age": None if self.last_check is None else round(time.time() - self.last_check, 3),
+            "last_error": self.last_error,
+        }
+
+    def wait_ready_sync(self, timeout: float = READY_WAIT) -> bool:
+        """Attende (bloccando) che Ollama sia pronto, al massimo timeout secondi"""
+        if self.state == UNAVAILABLE:
+            return False
+        return self._ready.wait(timeout)
+
+    async def wait_ready(self, timeout: float = READY_WAIT) -> bool:
+        """Attende che Ollama sia pronto senza bloccare l'event loop"""
+        deadline = time.monotonic() + timeout
+        while not self.ready:
+            if self.state == UNAVAILABLE or time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(STARTUP_PROBE_INTERVAL)
+        return True
+
+    def require_ready_sync(self, timeout: float = READY_WAIT):
+        """Come wait_ready_sync, ma solleva OllamaUnavailableError se non è pronto"""
+        if not self.wait_ready_sync(timeout):
+            raise OllamaUnavailableError(f"Ollama non disponibile ({self.state})")
+
+    async def require_ready(self, timeout: float = READY_WAIT):
+        """Come wait_ready, ma solleva OllamaUnavailableError se non è pronto"""
+        if not await self.wait_ready(timeout):
+            raise OllamaUnavailableError(f"Ollama non disponibile ({self.state})")
+
+supervisor = OllamaSupervisor()
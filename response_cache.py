@@ -0,0 +1,115 @@
+# response_cache.py
+
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from embeddings import normalize
+from metrics import metrics
+
+# Configurazione logging
+logger = logging.getLogger(__name__)
+
+CACHE_SIZE = 512        # risposte memorizzate al massimo (LRU)
+CACHE_TTL  = 600        # secondi di validità di una risposta
+SEMANTIC_MAX_DISTANCE = None   # distanza coseno massima per un hit semantico (None = disattivato)
+
+class ResponseCache:
+    """
+    Cache delle risposte dell'LLM.
+    Hit esatto: stesso modello e stesso prompt (dopo normalize).
+    Hit semantico (opzionale): stesso modello e contesto, domanda con embedding
+    entro `semantic_max_distance` da una già risposta.
+    """
+
+    def __init__(self, max_size: int = CACHE_SIZE, ttl: float = CACHE_TTL,
+                 semantic_max_distance: float = SEMANTIC_MAX_DISTANCE):
+        self.max_size = max_size
+        self.ttl      = ttl
+        self.semantic_max_distance = semantic_max_distance
+        self._entries = OrderedDict()   # {chiave: (scadenza, modello, contesto, embedding, risposta)}
+        self._lock    = threading.Lock()
+        self.hits     = 0
+        self.semantic_hits = 0
+        self.misses   = 0
+
+    @staticmethod
+    def key(model: str, prompt: str) -> str:
+        """Chiave esatta: hash di modello + prompt normalizzato"""
+        return hashlib.sha256(f"{model}\0{normalize(prompt)}".encode("utf-8")).hexdigest()
+
+    def get(self, model: str, prompt: str, embedding=None, context: str = ""):
+        """Risposta in cache o None"""
+        key = self.key(model, prompt)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    metrics.inc("response_cache", result="hit")
+                    return entry[4]
+                del self._entries[key]
+
+            if self.semantic_max_distance is not None and embedding is not None:
+                response = self._semantic_lookup(model, context, _unit(embedding), now)
+                if response is not None:
+                    self.semantic_hits += 1
+                    metrics.inc("response_cache", result="semantic_hit")
+                    return response
+
+            self.misses += 1
+            metrics.inc("response_cache", result="miss")
+            return None
+
+    def _semantic_lookup(self, model: str, context: str, query, now: float):
+        """Cerca la risposta con la domanda più simile (chiamare con il lock)"""
+        candidates = [(key, entry) for key, entry in self._entries.items()
+                      if entry[0] > now and entry[1] == model and entry[2] == context and entry[3] is not None]
+        if not candidates:
+            return None
+
+        similarities = np.stack([entry[3] for _, entry in candidates]) @ query
+        best = int(similarities.argmax())
+        if 1.0 - similarities[best] > self.semantic_max_distance:
+            return None
+
+        key, entry = candidates[best]
+        self._entries.move_to_end(key)
+        logger.debug(f"🎯 Hit semantico in cache (distanza {1.0 - similarities[best]:.3f})")
+        return entry[4]
+
+    def put(self, model: str, prompt: str, response: str, embedding=None, context: str = ""):
+        """Memorizza una risposta, eliminando le meno usate oltre max_size"""
+        key = self.key(model, prompt)
+        unit = _unit(embedding) if embedding is not None else None
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, model, context, unit, response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Svuota la cache"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """Contatori di hit/miss e dimensione attuale"""
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+            }
+
+def _unit(embedding) -> np.ndarray:
+    """Embedding a norma unitaria (prodotto scalare = similarità coseno)"""
+    vec = np.asarray(embedding, dtype="float32").ravel()
+    return vec / max(float(np.linalg.norm(vec)), 1e-12)
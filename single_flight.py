@@ -0,0 +1,92 @@
+# single_flight.py
+
+import asyncio
+import logging
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+class _Broadcast:
+    """Elementi già prodotti da uno stream condiviso, riletti da ogni consumatore"""
+
+    def __init__(self):
+        self.items = []
+        self.done  = False
+        self.error = None
+        self.event = asyncio.Event()   # sostituito a ogni nuovo elemento
+
+    def notify(self):
+        event, self.event = self.event, asyncio.Event()
+        event.set()
+
+class SingleFlight:
+    """
+    Unisce le chiamate identiche in corso: la prima esegue il lavoro, le altre con la stessa chiave
+    ne attendono il risultato (do) o ricevono gli stessi elementi dello stream (stream),
+    compresi quelli già prodotti prima del loro arrivo.
+
+    Il lavoro gira in un task a parte: se il client che l'ha avviato si disconnette,
+    gli altri non vengono interrotti. Va usato da un solo event loop.
+    """
+
+    def __init__(self, name: str):
+        self.name     = name
+        self._calls   = {}   # {chiave: Task}
+        self._streams = {}   # {chiave: _Broadcast}
+
+    async def do(self, key, fn):
+        """Risultato di `await fn()`, condiviso con le chiamate contemporanee con la stessa chiave"""
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._finished(self._calls, key, done))
+        else:
+            metrics.inc("coalesced", flight=self.name, kind="call")
+        return await asyncio.shield(task)
+
+    async def stream(self, key, fn):
+        """Elementi di `fn()` (async generator), condivisi con gli stream contemporanei con la stessa chiave"""
+        broadcast = self._streams.get(key)
+        if broadcast is None:
+            broadcast = self._streams[key] = _Broadcast()
+            task = asyncio.ensure_future(self._pump(broadcast, fn))
+            task.add_done_callback(lambda done: self._finished(self._streams, key, broadcast))
+        else:
+            metrics.inc("coalesced", flight=self.name, kind="stream")
+
+        i = 0
+        while True:
+            event = broadcast.event
+            while i < len(broadcast.items):
+                yield broadcast.items[i]
+                i += 1
+            if broadcast.done:
+                if broadcast.error is not None:
+                    raise broadcast.error
+                return
+            await event.wait()
+
+    @staticmethod
+    async def _pump(broadcast: _Broadcast, fn):
+        try:
+            async for item in fn():
+                broadcast.items.append(item)
+                broadcast.notify()
+        except Exception as e:
+            broadcast.error = e
+        finally:
+            broadcast.done = True
+            broadcast.notify()
+
+    @staticmethod
+    def _finished(flights: dict, key, value):
+        """Libera la chiave (solo se appartiene ancora a questo volo) e consuma eventuali eccezioni"""
+        if flights.get(key) is value:
+            del flights[key]
+        if isinstance(value, asyncio.Future) and not value.cancelled() and value.exception() is not None:
+            logger.debug(f"Volo {key!r} terminato con errore: {value.exception()}")
+
+    def __len__(self):
+        return len(self._calls) + len(self._streams)
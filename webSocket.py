@@ -1,5 +1,66 @@
+import asyncio
+import logging
+from collections import deque
 from fastapi import WebSocket
-from typing import Set
+from typing import Union
+
+logger = logging.getLogger(__name__)
+
+SEND_QUEUE_SIZE = 100          # messaggi in coda per connessione
+SEND_TIMEOUT    = 10           # secondi massimi per un singolo invio
+SLOW_CLIENT_POLICY = "drop_oldest"   # "drop_oldest" (solo broadcast precedenti) oppure "disconnect" a coda piena
+
+Message = Union[str, dict]
+
+
+class _Connection:
+    """
+    Una connessione con la sua coda in uscita e il task che la svuota.
+    La coda tiene in ordine sia i frame della chat (mai scartati) sia i broadcast
+    (scartabili): ogni elemento è (broadcast?, messaggio).
+    """
+
+    def __init__(self, websocket: WebSocket, max_queue: int):
+        self.websocket = websocket
+        self.max_queue = max_queue
+        self.frames = deque()
+        self.broadcasts = 0              # broadcast presenti in coda
+        self.ready = asyncio.Event()     # c'è qualcosa da inviare
+        self.space = asyncio.Event()     # la coda non è piena
+        self.space.set()
+        self.task = None
+        self.dropped = 0
+
+    def full(self) -> bool:
+        return len(self.frames) >= self.max_queue
+
+    def push(self, message: Message, broadcast: bool):
+        self.frames.append((broadcast, message))
+        self.broadcasts += broadcast
+        self.ready.set()
+        if self.full():
+            self.space.clear()
+
+    def pop(self) -> Message:
+        broadcast, message = self.frames.popleft()
+        self.broadcasts -= broadcast
+        if not self.frames:
+            self.ready.clear()
+        self.space.set()
+        return message
+
+    def drop_oldest_broadcast(self) -> bool:
+        """Scarta il broadcast più vecchio in coda; False se ci sono solo frame della chat"""
+        if not self.broadcasts:
+            return False
+        for i, (broadcast, _) in enumerate(self.frames):
+            if broadcast:
+                del self.frames[i]
+                self.broadcasts -= 1
+                self.dropped += 1
+                self.space.set()
+                return True
+        return False
 
 
 class WebSocketServerSingleton:
@@ -8,19 +69,86 @@ class WebSocketServerSingleton:
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super(WebSocketServerSingleton, cls).__new__(cls)
-            cls._instance.connections = set()
+            cls._instance.connections = {}   # {WebSocket: _Connection}
         return cls._instance
 
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
-        self.connections.add(websocket)
+        conn = _Connection(websocket, SEND_QUEUE_SIZE)
+        conn.task = asyncio.create_task(self._writer(conn))
+        self.connections[websocket] = conn
 
     def disconnect(self, websocket: WebSocket):
-        self.connections.discard(websocket)
+        conn = self.connections.pop(websocket, None)
+        if conn and conn.task and conn.task is not asyncio.current_task():
+            conn.task.cancel()
+
+    async def _writer(self, conn: _Connection):
+        """Invia i messaggi della coda uno alla volta: un client lento rallenta solo sé stesso"""
+        try:
+            while True:
+                await conn.ready.wait()
+                message = conn.pop()
+                if isinstance(message, dict):
+                    await asyncio.wait_for(conn.websocket.send_json(message), SEND_TIMEOUT)
+                else:
+                    await asyncio.wait_for(conn.websocket.send_text(message), SEND_TIMEOUT)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Socket morto o troppo lento: la connessione viene rimossa
+            logger.warning(f"🔌 Connessione WebSocket rimossa: {e!r}")
+            self.disconnect(conn.websocket)
+
+    def _close_slow(self, conn: _Connection):
+        """Chiude un client che non riesce a stare al passo"""
+        logger.warning("🐢 Client WebSocket troppo lento: disconnesso")
+        self.disconnect(conn.websocket)
+
+        async def _close():
+            try:
+                await conn.websocket.close(code=1013)
+            except Exception:
+                pass
+        asyncio.create_task(_close())
+
+    def _enqueue(self, conn: _Connection, message: Message):
+        """
+        Accoda un broadcast senza attendere, applicando la politica per i client lenti:
+        a coda piena si scarta il broadcast più vecchio, mai un frame della chat; se la coda
+        contiene solo frame della chat il client viene disconnesso
+        """
+        if conn.full():
+            if SLOW_CLIENT_POLICY == "disconnect" or not conn.drop_oldest_broadcast():
+                self._close_slow(conn)
+                return
+        conn.push(message, broadcast=True)
+
+    async def send(self, websocket: WebSocket, message: Message) -> bool:
+        """
+        Invia a una sola connessione passando dalla sua coda.
+        A coda piena attende (backpressure), così i token di una risposta non vanno persi.
+        """
+        conn = self.connections.get(websocket)
+        if conn is None:
+            return False
+        try:
+            await asyncio.wait_for(self._wait_space(conn), SEND_TIMEOUT)
+        except asyncio.TimeoutError:
+            self._close_slow(conn)
+            return False
+        conn.push(message, broadcast=False)
+        return True
+
+    @staticmethod
+    async def _wait_space(conn: _Connection):
+        while conn.full():
+            await conn.space.wait()
 
-    async def broadcast(self, message: str):
-        for conn in self.connections:
-            await conn.send_text(message)
+    async def broadcast(self, message: Message):
+        # Copia: connect/disconnect possono modificare il dizionario durante il ciclo
+        for conn in list(self.connections.values()):
+            self._enqueue(conn, message)
 
 async def send_ws_message(message: str):
     ws_server = WebSocketServerSingleton()